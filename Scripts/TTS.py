@@ -7,19 +7,31 @@ from googleapiclient.errors import HttpError
 import datetime
 import zipfile
 import io
-import copy
-import re
+import wave
 from urllib.request import urlopen
 import aiohttp
 import asyncio
 import html
-from typing import Optional, Any, Dict, cast
+import shutil
+import atexit
+import threading
+import concurrent.futures
+import queue
+import contextlib
+import contextvars
+import hashlib
+from typing import Optional, Any, Callable, Dict, Iterator, cast
 
 from Scripts.shared_imports import *
 import Scripts.auth as auth
 auth.authenticate_required_services() #Might not be necessary to do right after import but just in case
 import Scripts.azure_batch as azure_batch
 import Scripts.utils as utils
+from Scripts.rate_limit import TokenBucket
+from Scripts.adaptive_concurrency import AdaptiveConcurrencyLimiter, parse_retry_after, backoff_delay, load_saved_limit, save_limit
+from Scripts.disk_cache import DiskCache, CacheStats
+from Scripts.pronunciation import PronunciationOverrides
+import Scripts.speaking_rate as speaking_rate
 
 # Get variables from config
 
@@ -28,6 +40,23 @@ AZURE_SPEECH_KEY = cloudConfig.azure_speech_key
 AZURE_SPEECH_REGION = cloudConfig.azure_speech_region
 ELEVENLABS_API_KEY = cloudConfig.elevenlabs_api_key
 
+# Shared by every Google TTS request, so the quota is respected no matter how many threads are making requests
+GOOGLE_TTS_RATE_LIMITER = TokenBucket(cloudConfig.google_tts_requests_per_minute)
+
+# Shared by every ElevenLabs request, so the number of requests at once stays within what the account's plan allows, no matter how many languages are running
+# The limit that worked on the last run is saved per account (only a hash of the API key is stored), and is used as the starting point for the next run
+ELEVENLABS_CONCURRENCY_FILE = os.path.join(CACHE_DIRECTORY, 'elevenlabs_concurrency.json')
+ELEVENLABS_ACCOUNT_KEY = hashlib.sha256(ELEVENLABS_API_KEY.encode('utf-8')).hexdigest()[:16]
+ELEVENLABS_MAX_RETRIES = 6
+ELEVENLABS_RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+ELEVENLABS_OVERLOAD_STATUS_CODES = {429, 503} # Too many requests at once, so the limit is lowered
+ELEVENLABS_CONCURRENCY_LIMITER = AdaptiveConcurrencyLimiter(
+    (cloudConfig.elevenlabs_adaptive_concurrency and load_saved_limit(ELEVENLABS_CONCURRENCY_FILE, ELEVENLABS_ACCOUNT_KEY)) or cloudConfig.elevenlabs_max_concurrent,
+    cloudConfig.elevenlabs_max_concurrent,
+    adaptive=cloudConfig.elevenlabs_adaptive_concurrency,
+    name='ElevenLabs requests'
+)
+
 # Get List of Voices Available
 def get_voices():
     voices = auth.GOOGLE_TTS_API.voices().list().execute() #type:ignore
@@ -35,105 +64,98 @@ def get_voices():
     return voices_json
 
 
-# ======================================== Pronunciation Correction Functions ================================================
-
-interpretAsOverrideFile = os.path.join('SSML_Customization', 'interpret-as.csv')
-interpretAsEntries = utils.csv_to_dictList(interpretAsOverrideFile)
-
-aliasOverrideFile = os.path.join('SSML_Customization', 'aliases.csv')
-aliasEntries = utils.csv_to_dictList(aliasOverrideFile)
-
-urlListFile = os.path.join('SSML_Customization', 'url_list.txt')
-urlList = utils.txt_to_list(urlListFile)
-
-phonemeFile = os.path.join('SSML_Customization', 'Phoneme_Pronunciation.csv')
-phonemeEntries = utils.csv_to_dictList(phonemeFile)
-
-def add_all_pronunciation_overrides(text):
-    text = add_interpretas_tags(text)
-    text = add_alias_tags(text)
-    text = add_phoneme_tags(text)
-    return text
-
-def add_interpretas_tags(text:str) -> str:
-    # Add interpret-as tags from interpret-as.csv
-    for entryDict in interpretAsEntries:
-        # Get entry info
-        entryText = entryDict['Text']
-        entryInterpretAsType = entryDict['interpret-as Type']
-        isCaseSensitive = parseBool(entryDict['Case Sensitive (True/False)'])
-        entryFormat = entryDict['Format (Optional)']
-
-        # Create say-as tag
-        if entryFormat == "":
-            sayAsTagStart = rf'<say-as interpret-as="{entryInterpretAsType}">'
-        else:
-            sayAsTagStart = rf'<say-as interpret-as="{entryInterpretAsType}" format="{entryFormat}">'
-        
-        # Find and replace the word
-        findWordRegex = rf'(\b["\']?{entryText}[.,!?]?["\']?\b)' # Find the word, with optional punctuation after, and optional quotes before or after
-        if isCaseSensitive:
-            text = re.sub(findWordRegex, rf'{sayAsTagStart}\1</say-as>', text) # Uses group reference, so remember regex must be in parentheses
-            
-        else:
-            text = re.sub(findWordRegex, rf'{sayAsTagStart}\1</say-as>', text, flags=re.IGNORECASE)
-
-    # Add interpret-as tags from url_list.txt
-    for url in urlList:
-        # This regex expression will match the top level domain extension, and the punctuation before/after it, and any periods, slashes or colons
-        # It will then put the say-as characters tag around all matches
-        punctuationRegex = re.compile(r'((?:\.[a-z]{2,6}(?:\/|$|\s))|(?:[\.\/:]+))') 
-        taggedURL = re.sub(punctuationRegex, r'<say-as interpret-as="characters">\1</say-as>', url)
-        # Replace any instances of the URL with the tagged version
-        text = text.replace(url, taggedURL)
-
-    return text
-
-def add_alias_tags(text:str) -> str:
-    for entryDict in aliasEntries:
-        # Get entry info
-        entryText = entryDict['Original Text']
-        entryAlias = entryDict['Alias']
-        if entryDict['Case Sensitive (True/False)'] == "":
-            isCaseSensitive = False
-        else:
-            isCaseSensitive = parseBool(entryDict['Case Sensitive (True/False)'])
-
-        # Find and replace the word
-        findWordRegex = rf'\b["\'()]?{entryText}[.,!?()]?["\']?\b' # Find the word, with optional punctuation after, and optional quotes before or after
-        if isCaseSensitive:
-            text = re.sub(findWordRegex, rf'{entryAlias}', text)
-        else:
-            text = re.sub(findWordRegex, rf'{entryAlias}', text, flags=re.IGNORECASE)
-    return text
+# ======================================== TTS Cache ================================================
+# Synthesized audio is kept between runs, keyed by everything that is sent to the TTS service
+# So a line that was already synthesized with the same text, voice and settings is loaded from disk without any API call
+
+TTS_CACHE = DiskCache(TTS_CACHE_FOLDER, config.tts_cache_max_size_mb) if config.tts_cache else None
+_ttsCacheLock = threading.Lock() # The cache's hit and miss counters are shared by all the synthesis threads
+
+def tts_cache_key(*parts:object) -> str:
+    return DiskCache.make_key('tts', *parts)
+
+def get_cached_audio(cacheKey:str) -> Optional[bytes]:
+    if TTS_CACHE is None:
+        return None
+    with _ttsCacheLock:
+        return TTS_CACHE.get(cacheKey)
+
+def put_cached_audio(cacheKey:str, audio:bytes|bytearray) -> None:
+    # Failed requests return empty audio, which should never be cached
+    if TTS_CACHE is not None and audio:
+        TTS_CACHE.put(cacheKey, bytes(audio))
+
+# Prints the hits and misses since the last time this was called, and deletes old audio if the cache got too big
+def finish_tts_cache() -> None:
+    if TTS_CACHE is None:
+        return
+    with _ttsCacheLock:
+        cacheStats = CacheStats(TTS_CACHE.hits, TTS_CACHE.misses)
+        TTS_CACHE.hits, TTS_CACHE.misses = 0, 0
+    if cacheStats.hits + cacheStats.misses > 0:
+        print(cacheStats.summary("TTS cache"))
+    TTS_CACHE.enforce_size_limit()
+
+
+# ======================================== Audio Format ================================================
+# With tts_audio_format = pcm, every service is asked for uncompressed 16 bit mono audio, at the supported sample rate closest to the canvas sample rate
+# The files are saved as wav, which the audio builder reads directly instead of having ffmpeg decode an mp3
+
+USE_PCM_AUDIO = config.tts_audio_format == TTSAudioFormat.PCM
+TTS_FILE_EXTENSION = 'wav' if USE_PCM_AUDIO else 'mp3'
+
+# Returns the lowest rate that is at least the canvas sample rate, so nothing is lost when resampling. Otherwise the highest rate
+def closest_supported_sample_rate(supportedRates:list[int]) -> int:
+    higherRates = [rate for rate in supportedRates if rate >= config.canvas_sample_rate]
+    return min(higherRates) if higherRates else max(supportedRates)
+
+# Google can return LINEAR16 at any sample rate, and includes a wav header
+GOOGLE_SAMPLE_RATE = config.canvas_sample_rate
+
+# Azure's riff formats include a wav header. The real-time and batch APIs use different names for the same formats
+AZURE_PCM_FORMATS = {
+    8000: (speechsdk.SpeechSynthesisOutputFormat.Riff8Khz16BitMonoPcm, 'riff-8khz-16bit-mono-pcm'),
+    16000: (speechsdk.SpeechSynthesisOutputFormat.Riff16Khz16BitMonoPcm, 'riff-16khz-16bit-mono-pcm'),
+    22050: (speechsdk.SpeechSynthesisOutputFormat.Riff22050Hz16BitMonoPcm, 'riff-22050hz-16bit-mono-pcm'),
+    24000: (speechsdk.SpeechSynthesisOutputFormat.Riff24Khz16BitMonoPcm, 'riff-24khz-16bit-mono-pcm'),
+    44100: (speechsdk.SpeechSynthesisOutputFormat.Riff44100Hz16BitMonoPcm, 'riff-44100hz-16bit-mono-pcm'),
+    48000: (speechsdk.SpeechSynthesisOutputFormat.Riff48Khz16BitMonoPcm, 'riff-48khz-16bit-mono-pcm'),
+}
+if USE_PCM_AUDIO:
+    AZURE_OUTPUT_FORMAT, AZURE_BATCH_OUTPUT_FORMAT = AZURE_PCM_FORMATS[closest_supported_sample_rate(list(AZURE_PCM_FORMATS))]
+else:
+    AZURE_OUTPUT_FORMAT, AZURE_BATCH_OUTPUT_FORMAT = speechsdk.SpeechSynthesisOutputFormat.Audio48Khz192KBitRateMonoMp3, 'audio-48khz-192kbitrate-mono-mp3'
+
+# ElevenLabs returns raw samples without a header, so a wav header is added to them
+# PCM at 44.1KHz and above is only available on the higher subscription tiers, so at most 24KHz is requested, which every tier can use
+# The voices don't have much above what 24KHz can hold anyway, and the clips are resampled to the canvas rate like any other
+ELEVENLABS_SAMPLE_RATE = closest_supported_sample_rate([16000, 22050, 24000])
+ELEVENLABS_PCM_FORMAT = f'pcm_{ELEVENLABS_SAMPLE_RATE}'
+
+def pcm_to_wav(pcmData:bytes|bytearray, sampleRate:int) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wavFile:
+        wavFile.setnchannels(1)
+        wavFile.setsampwidth(2) # 16 bit
+        wavFile.setframerate(sampleRate)
+        wavFile.writeframes(pcmData)
+    return buffer.getvalue()
 
 
-# Uses the phoneme pronunciation file to add phoneme tags to the text
-def add_phoneme_tags(text:str) -> str:
-    for entryDict in phonemeEntries:
-        # Get entry info
-        entryText = entryDict['Text']
-        entryPhoneme = entryDict['Phonetic Pronunciation']
-        entryAlphabet = entryDict['Phonetic Alphabet']
+# ======================================== Pronunciation Correction Functions ================================================
 
-        if entryDict['Case Sensitive (True/False)'] == "":
-            isCaseSensitive = False
-        else:
-            isCaseSensitive = parseBool(entryDict['Case Sensitive (True/False)'])
+# Compiled once when the program starts. The compiled form is cached, and only rebuilt when one of the customization files changes
+PRONUNCIATION_OVERRIDES = PronunciationOverrides.load()
 
-        # Find and replace the word
-        findWordRegex = rf'(\b["\'()]?{entryText}[.,!?()]?["\']?\b)' # Find the word, with optional punctuation after, and optional quotes before or after
-        if isCaseSensitive:
-            text = re.sub(findWordRegex, rf'<phoneme alphabet="ipa" ph="{entryPhoneme}">\1</phoneme>', text)
-        else:
-            text = re.sub(findWordRegex, rf'<phoneme alphabet="{entryAlphabet}" ph="{entryPhoneme}">\1</phoneme>', text, flags=re.IGNORECASE)
-    return text
+def add_all_pronunciation_overrides(text:str) -> str:
+    return PRONUNCIATION_OVERRIDES.apply(text)
 
 
 # =============================================================================================================================
 
 # Build API request for google text to speech, then execute
-def synthesize_text_google(text:str, speedFactor:float, voiceName:str, voiceGender:str, languageCode:str, audioEncoding:str=config.synth_audio_encoding.upper()) -> bytes:
+# When called from multiple threads, each thread must pass its own http object (see auth.new_google_http)
+def synthesize_text_google(text:str, speedFactor:float, voiceName:str, voiceGender:str, languageCode:str, audioEncoding:str='LINEAR16' if USE_PCM_AUDIO else config.synth_audio_encoding.upper(), http:Optional[object]=None, rateLimiter:Optional[TokenBucket]=GOOGLE_TTS_RATE_LIMITER) -> bytes:
 
     # Keep speedFactor between 0.25 and 4.0
     if speedFactor < 0.25:
@@ -141,9 +163,25 @@ def synthesize_text_google(text:str, speedFactor:float, voiceName:str, voiceGend
     elif speedFactor > 4.0:
         speedFactor = 4.0
 
+    # Google is sent the plain text, so the key is the text plus every other setting in the request
+    audioConfig:dict[str, Any] = {
+        "audioEncoding": audioEncoding, # MP3 or LINEAR16
+        "speakingRate": speedFactor
+    }
+    sampleRateParts:list[int] = []
+    if audioEncoding == 'LINEAR16':
+        audioConfig["sampleRateHertz"] = GOOGLE_SAMPLE_RATE
+        sampleRateParts = [GOOGLE_SAMPLE_RATE]
+    cacheKey = tts_cache_key(str(TTSService.GOOGLE), text, speedFactor, voiceName, voiceGender, languageCode, audioEncoding, *sampleRateParts)
+    cachedAudio = get_cached_audio(cacheKey)
+    if cachedAudio is not None:
+        return cachedAudio
+
     # API Info at https://texttospeech.googleapis.com/$discovery/rest?version=v1
-    # Try, if error regarding quota, waits a minute and tries again
+    # Waits for the rate limiter before sending, so requests stay under the quota
     def send_request(speedFactor:float) -> Dict[str, Any]:
+        if rateLimiter:
+            rateLimiter.acquire()
         response = auth.GOOGLE_TTS_API.text().synthesize( #type:ignore
             body={
                 'input':{
@@ -154,32 +192,36 @@ def synthesize_text_google(text:str, speedFactor:float, voiceName:str, voiceGend
                     "ssmlGender": voiceGender, # MALE
                     "name": voiceName # "en-US-Neural2-I"
                 },
-                'audioConfig':{
-                    "audioEncoding": audioEncoding, # MP3
-                    "speakingRate": speedFactor
-                }
+                'audioConfig': audioConfig
             }
-        ).execute()
+        ).execute(http=http)
         return response
 
     # Use try except to catch quota errors, there is a limit of 100 requests per minute for neural2 voices
+    # The rate limiter should prevent these, but if the quota is exceeded anyway, back off for longer each time and try again
     response = None
     decoded_audio = b''
-    try:
-        response = send_request(speedFactor)
-    except HttpError as hx:
-        print("Error Message: " + str(hx))
-        if "Resource has been exhausted" in str(hx):
-            # Wait 65 seconds, then try again
-            print("Waiting 65 seconds to try again")
-            time.sleep(65)
-            print("Trying again...")
+    maxAttempts = 5
+    for attempt in range(maxAttempts):
+        try:
             response = send_request(speedFactor)
-        else:
+            break
+        except HttpError as hx:
+            if "Resource has been exhausted" in str(hx) and attempt < maxAttempts - 1:
+                waitSeconds = min(65, 5 * 2 ** attempt)
+                print(f"\nQuota exceeded. Waiting {waitSeconds} seconds to try again")
+                if rateLimiter:
+                    rateLimiter.pause(waitSeconds) # Makes all other threads wait too
+                else:
+                    time.sleep(waitSeconds)
+                continue
+            print("Error Message: " + str(hx))
             input("Press Enter to continue...")
-    except Exception as ex:
-        print("Error Message: " + str(ex))
-        input("Press Enter to try continuing anyway...")
+            break
+        except Exception as ex:
+            print("Error Message: " + str(ex))
+            input("Press Enter to try continuing anyway...")
+            break
 
     # The response's audioContent is base64. Must decode to selected audio format
     if response:
@@ -189,11 +231,112 @@ def synthesize_text_google(text:str, speedFactor:float, voiceName:str, voiceGend
             print("Error decoding audio content")
             input("Press Enter to try continuing anyway...")
             # Return empty bytes as declared above
-        
+
+    put_cached_audio(cacheKey, decoded_audio)
     return decoded_audio
 
-async def synthesize_text_elevenlabs_async_http(text:str, voiceID:str, modelID:str, apiKey:str=ELEVENLABS_API_KEY) -> Optional[bytes]:
+# ======================================== Shared Async Resources ================================================
+# One event loop is kept for the whole run, so the ElevenLabs session and its open keep-alive connections are reused by every line and every language
+# The loop runs in its own thread, so languages being processed at the same time can all use it at once
+_eventLoop:Optional[asyncio.AbstractEventLoop] = None
+_eventLoopThread:Optional[threading.Thread] = None
+_eventLoopLock = threading.Lock()
+_elevenLabsSession:Optional[aiohttp.ClientSession] = None
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    global _eventLoop, _eventLoopThread
+    with _eventLoopLock:
+        if _eventLoop is None or _eventLoop.is_closed():
+            _eventLoop = asyncio.new_event_loop()
+            _eventLoopThread = threading.Thread(target=_eventLoop.run_forever, name='TTS event loop', daemon=True)
+            _eventLoopThread.start()
+        return _eventLoop
+
+# Runs the coroutine with the context variables of the thread that started it, such as where its language's output is printed
+async def _run_in_context(coroutine, context:contextvars.Context):
+    for variable, value in context.items():
+        variable.set(value)
+    return await coroutine
+
+# Use instead of asyncio.run, which would create (and then close) a new event loop every time. Blocks until the coroutine is finished
+def run_async(coroutine):
+    return asyncio.run_coroutine_threadsafe(_run_in_context(coroutine, contextvars.copy_context()), get_event_loop()).result()
+
+# Must be called from within run_async, since the session belongs to that event loop
+async def get_elevenlabs_session() -> aiohttp.ClientSession:
+    global _elevenLabsSession
+    if _elevenLabsSession is None or _elevenLabsSession.closed:
+        connector = aiohttp.TCPConnector(limit_per_host=max(1, cloudConfig.elevenlabs_max_concurrent), keepalive_timeout=60, ttl_dns_cache=300)
+        _elevenLabsSession = aiohttp.ClientSession(connector=connector)
+    return _elevenLabsSession
+
+def close_async_resources() -> None:
+    global _elevenLabsSession
+    if _eventLoop is None or _eventLoop.is_closed():
+        return
+    if _elevenLabsSession is not None and not _elevenLabsSession.closed:
+        asyncio.run_coroutine_threadsafe(_elevenLabsSession.close(), _eventLoop).result()
+    _elevenLabsSession = None
+    _eventLoop.call_soon_threadsafe(_eventLoop.stop)
+    if _eventLoopThread is not None:
+        _eventLoopThread.join()
+    _eventLoop.close()
+
+atexit.register(close_async_resources)
+
+# Reads the whole response body. If the length is known, chunks are copied into a buffer allocated once up front
+async def read_response_body(response:aiohttp.ClientResponse, chunkSize:int=65536) -> bytes|bytearray:
+    contentLength = response.content_length
+    if not contentLength:
+        # Streamed responses don't say their length, so collect the chunks and join them once at the end
+        chunks = [chunk async for chunk in response.content.iter_chunked(chunkSize)]
+        return b''.join(chunks)
+
+    buffer = bytearray(contentLength)
+    bufferView = memoryview(buffer)
+    position = 0
+    async for chunk in response.content.iter_chunked(chunkSize):
+        if position + len(chunk) > contentLength: # More data than the header said, shouldn't happen
+            buffer.extend(b'\0' * (position + len(chunk) - contentLength))
+            bufferView = memoryview(buffer)
+            contentLength = len(buffer)
+        bufferView[position:position + len(chunk)] = chunk
+        position += len(chunk)
+    del bufferView # The buffer can't be resized while a memoryview of it exists
+    del buffer[position:]
+    return buffer
+
+# =============================================================================================================================
+
+# Prints the details of an error response from ElevenLabs
+async def print_elevenlabs_error(response:aiohttp.ClientResponse) -> None:
+    try:
+        error_message = await response.text()
+        error_dict = json.loads(error_message)
+        print(f"\n\nERROR: ElevenLabs API returned code: {response.status}  -  {response.reason}")
+        print(f" - Returned Error Status: {error_dict['detail']['status']}")
+        print(f" - Returned Error Message: {error_dict['detail']['message']}")
+
+        # Handle specific errors:
+        if error_dict['detail']['status'] == "invalid_uid" or error_dict['detail']['status'] == "voice_not_found":
+            print("    > You may have forgotten to set the voice name in batch.ini to an Elevenlabs Voice ID. The above message should tell you what invalid voice is currently set.")
+            print("    > See this article for how to find a voice ID: https://help.elevenlabs.io/hc/en-us/articles/14599760033937-How-do-I-find-my-voices-ID-of-my-voices-via-the-website-and-through-the-API-")
+    # These are for errors that don't have a 'detail' key
+    except KeyError:
+        if response.status == 401:
+            print("  > ElevenLabs did not accept the API key or you are unauthorized to use that voice.")
+            print("  > Did you set the correct ElevenLabs API key in the cloud_service_settings.ini file?\n")
+        elif response.status == 400:
+            print("  > Did you set the correct ElevenLabs API key in the cloud_service_settings.ini file?\n")
+        elif response.status == 429:
+            print("  > You may have exceeded the ElevenLabs API rate limit. Did you set the 'elevenlabs_max_concurrent' setting too high for your plan?\n")
+    except Exception as ex:
+        print(f"ElevenLabs API error occurred.\n")
+
+async def synthesize_text_elevenlabs_async_http(text:str, voiceID:str, modelID:str, apiKey:str=ELEVENLABS_API_KEY, session:Optional[aiohttp.ClientSession]=None) -> Optional[bytes|bytearray]:
     url = f"https://api.elevenlabs.io/v1/text-to-speech/{voiceID}"
+    if USE_PCM_AUDIO:
+        url += f"?output_format={ELEVENLABS_PCM_FORMAT}"
     headers = {
         "Accept": "audio/mpeg",
         "Content-Type": "application/json",
@@ -208,44 +351,92 @@ async def synthesize_text_elevenlabs_async_http(text:str, voiceID:str, modelID:s
         # }
     }
     
-    audio_bytes:bytes = b''  # Initialize an empty bytes object
-
-    async with aiohttp.ClientSession() as session:
-        async with session.post(url, json=data, headers=headers) as response:
-            if response.status == 200:
-                while True:
-                    chunk = await response.content.read(1024)
-                    if not chunk:
-                        break
-                    audio_bytes += chunk
-            else:
-                try:
-                    error_message = await response.text()
-                    error_dict = json.loads(error_message)
-                    print(f"\n\nERROR: ElevenLabs API returned code: {response.status}  -  {response.reason}")
-                    print(f" - Returned Error Status: {error_dict['detail']['status']}")
-                    print(f" - Returned Error Message: {error_dict['detail']['message']}")
-                    
-                    # Handle specific errors:
-                    if error_dict['detail']['status'] == "invalid_uid" or error_dict['detail']['status'] == "voice_not_found":
-                        print("    > You may have forgotten to set the voice name in batch.ini to an Elevenlabs Voice ID. The above message should tell you what invalid voice is currently set.")
-                        print("    > See this article for how to find a voice ID: https://help.elevenlabs.io/hc/en-us/articles/14599760033937-How-do-I-find-my-voices-ID-of-my-voices-via-the-website-and-through-the-API-")
-                # These are for errors that don't have a 'detail' key
-                except KeyError:
-                    if response.status == 401:
-                        print("  > ElevenLabs did not accept the API key or you are unauthorized to use that voice.")
-                        print("  > Did you set the correct ElevenLabs API key in the cloud_service_settings.ini file?\n")
-                    elif response.status == 400:
-                        print("  > Did you set the correct ElevenLabs API key in the cloud_service_settings.ini file?\n")
-                    elif response.status == 429:
-                        print("  > You may have exceeded the ElevenLabs API rate limit. Did you set the 'elevenlabs_max_concurrent' setting too high for your plan?\n")
-                except Exception as ex:
-                    print(f"ElevenLabs API error occurred.\n")
+    audio_bytes:bytes|bytearray = b''  # Initialize an empty bytes object
+
+    cacheKey = tts_cache_key(str(TTSService.ELEVENLABS), text, voiceID, modelID, headers["Accept"], *([ELEVENLABS_PCM_FORMAT] if USE_PCM_AUDIO else []))
+    cachedAudio = get_cached_audio(cacheKey)
+    if cachedAudio is not None:
+        return cachedAudio
+
+    if session is None:
+        session = await get_elevenlabs_session()
+    # Too many requests at once, server errors and dropped connections are retried after waiting, instead of failing the line
+    for attempt in range(ELEVENLABS_MAX_RETRIES + 1):
+        retryReason = ''
+        retryAfter:Optional[float] = None
+        ticket = await ELEVENLABS_CONCURRENCY_LIMITER.acquire()
+        try:
+            async with session.post(url, json=data, headers=headers) as response:
+                if response.status == 200:
+                    audio_bytes = await read_response_body(response)
+                    ELEVENLABS_CONCURRENCY_LIMITER.record_success()
+                elif response.status in ELEVENLABS_RETRY_STATUS_CODES and attempt < ELEVENLABS_MAX_RETRIES:
+                    retryReason = f"ElevenLabs API returned code: {response.status}  -  {response.reason}"
+                    retryAfter = parse_retry_after(response.headers.get('Retry-After'))
+                    if response.status in ELEVENLABS_OVERLOAD_STATUS_CODES:
+                        ELEVENLABS_CONCURRENCY_LIMITER.record_overload(ticket, retryAfter if retryAfter is not None else backoff_delay(attempt))
+                else:
+                    await print_elevenlabs_error(response)
+                    return None
+        except (aiohttp.ClientError, asyncio.TimeoutError) as ex:
+            if attempt == ELEVENLABS_MAX_RETRIES:
+                print(f"\n\nERROR: Could not connect to ElevenLabs: {type(ex).__name__}: {ex}")
                 return None
-
+            retryReason = f"Could not connect to ElevenLabs: {type(ex).__name__}"
+        finally:
+            await ELEVENLABS_CONCURRENCY_LIMITER.release()
+
+        if not retryReason:
+            break
+        delay = retryAfter if retryAfter is not None else backoff_delay(attempt)
+        print(f"\n  > {retryReason}. Retrying in {delay:.1f} seconds (Attempt {attempt + 1} of {ELEVENLABS_MAX_RETRIES})")
+        await asyncio.sleep(delay)
+
+    if USE_PCM_AUDIO:
+        audio_bytes = pcm_to_wav(audio_bytes, ELEVENLABS_SAMPLE_RATE)
+    put_cached_audio(cacheKey, audio_bytes)
     return audio_bytes
 
-def synthesize_text_azure(text:str, duration:str|int|float, voiceName:str, languageCode:str, style:str) -> speechsdk.AudioDataStream:
+# Keeps a set of Azure synthesizers with their connections already open, so each line doesn't have to set up a new connection
+# The voice is set in the SSML of each request, so the same synthesizers can be used for any voice or language
+class AzureSynthesizerPool:
+    def __init__(self, size:int):
+        self.available:queue.Queue[speechsdk.SpeechSynthesizer] = queue.Queue()
+        self.connections:list[speechsdk.Connection] = [] # Must be kept referenced, otherwise the connections get closed
+        for _ in range(max(1, size)):
+            speech_config = speechsdk.SpeechConfig(subscription=AZURE_SPEECH_KEY, region=AZURE_SPEECH_REGION)
+            # For audio outputs, see: https://learn.microsoft.com/en-us/python/api/azure-cognitiveservices-speech/azure.cognitiveservices.speech.speechsynthesisoutputformat?view=azure-python
+            speech_config.set_speech_synthesis_output_format(AZURE_OUTPUT_FORMAT)
+            synthesizer = speechsdk.SpeechSynthesizer(speech_config=speech_config, audio_config=None)
+            connection = speechsdk.Connection.from_speech_synthesizer(synthesizer)
+            connection.open(True) # True because this is for synthesis
+            self.connections.append(connection)
+            self.available.put(synthesizer)
+
+    # Waits for a synthesizer to be free, and puts it back when done
+    @contextlib.contextmanager
+    def borrow(self) -> Iterator[speechsdk.SpeechSynthesizer]:
+        synthesizer = self.available.get()
+        try:
+            yield synthesizer
+        finally:
+            self.available.put(synthesizer)
+
+_azureSynthesizerPool:Optional[AzureSynthesizerPool] = None
+_azureSynthesizerPoolLock = threading.Lock()
+
+# Creates the pool the first time it's needed, then reuses it for every language
+# Locked so languages starting at the same time can't each create a pool, which would double the number of connections
+def get_azure_synthesizer_pool() -> AzureSynthesizerPool:
+    global _azureSynthesizerPool
+    if _azureSynthesizerPool is None:
+        with _azureSynthesizerPoolLock:
+            if _azureSynthesizerPool is None:
+                _azureSynthesizerPool = AzureSynthesizerPool(cloudConfig.azure_tts_max_concurrent)
+    return _azureSynthesizerPool
+
+# Creates the SSML for a line, used by both the real-time and batch Azure requests
+def build_azure_ssml(text:str, duration:str|int|float, voiceName:str, languageCode:str, style:str) -> str:
 
     # Create tag for desired duration of clip
     durationTag = f'<mstts:audioduration value="{str(duration)}ms"/>'
@@ -285,19 +476,31 @@ def synthesize_text_azure(text:str, duration:str|int|float, voiceName:str, langu
         "xmlns:mstts='http://www.w3.org/2001/mstts'>" \
         f"<voice name='{voiceName}'>{sentencePauseTag}{commaPauseTag}{durationTag}{leadSilenceTag}{tailSilenceTag}{styleTagStart}" \
         f"{text}{styleTagEnd}</voice></speak>"
+    return ssml
 
-    speech_config = speechsdk.SpeechConfig(subscription=AZURE_SPEECH_KEY, region=AZURE_SPEECH_REGION)
-    # For Azure voices, see: https://learn.microsoft.com/en-us/azure/cognitive-services/speech-service/language-support?tabs=stt-tts
-    speech_config.speech_synthesis_voice_name=voiceName
-    # For audio outputs, see: https://learn.microsoft.com/en-us/python/api/azure-cognitiveservices-speech/azure.cognitiveservices.speech.speechsynthesisoutputformat?view=azure-python
-    speech_config.set_speech_synthesis_output_format(speechsdk.SpeechSynthesisOutputFormat.Audio48Khz192KBitRateMonoMp3)
-    synthesizer = speechsdk.SpeechSynthesizer(speech_config=speech_config, audio_config=None)
+# Returns the synthesized audio in memory, or empty bytes if synthesis failed
+def synthesize_text_azure(text:str, duration:str|int|float, voiceName:str, languageCode:str, style:str, pool:Optional[AzureSynthesizerPool]=None) -> bytes:
+    ssml = build_azure_ssml(text, duration, voiceName, languageCode, style)
 
-    #result = synthesizer.speak_text_async(text).get()
-    result:Optional[speechsdk.ResultFuture] = synthesizer.speak_ssml_async(ssml).get() #type:ignore
-    
-    stream = speechsdk.AudioDataStream(result)
-    return stream
+    # The SSML already contains the text, voice, style, pauses and target duration
+    cacheKey = tts_cache_key(str(TTSService.AZURE), ssml, str(AZURE_OUTPUT_FORMAT))
+    cachedAudio = get_cached_audio(cacheKey)
+    if cachedAudio is not None:
+        return cachedAudio
+
+    # For Azure voices, see: https://learn.microsoft.com/en-us/azure/cognitive-services/speech-service/language-support?tabs=stt-tts
+    if pool is None:
+        pool = get_azure_synthesizer_pool()
+    with pool.borrow() as synthesizer:
+        result:speechsdk.SpeechSynthesisResult = synthesizer.speak_ssml_async(ssml).get() #type:ignore
+
+    if result.reason == speechsdk.ResultReason.SynthesizingAudioCompleted:
+        put_cached_audio(cacheKey, result.audio_data)
+        return result.audio_data
+    if result.reason == speechsdk.ResultReason.Canceled:
+        cancellationDetails = result.cancellation_details
+        print(f"\nERROR: Azure TTS failed: {cancellationDetails.reason} - {cancellationDetails.error_details}")
+    return b''
 
 def format_percentage_change(speedFactor:float) -> str:
     # Determine speedFactor value for Azure TTS. It should be either 'default' or a relative change.
@@ -313,242 +516,302 @@ def format_percentage_change(speedFactor:float) -> str:
         rate = percentSign + str(round((speedFactor - 1.0) * 100, 5)) + '%'
     return rate
 
-def synthesize_text_azure_batch(subsDict:SubtitleDict, langDict:Dict[LangDictKeys, Any], skipSynthesize:bool=False, secondPass:bool=False) -> SubtitleDict:
-
-    def create_request_payload(remainingEntriesDict):
-        # Create SSML for all subtitles
-        ssmlJson:list = []
-        payloadSizeInBytes:int = 0
-        tempDict = dict(remainingEntriesDict) # Need to do this to avoid changing the original dict which would mess with the loop
-        payload:dict = {}
+def synthesize_text_azure_batch(subsDict:SubtitleDict, langDict:Dict[LangDictKeys, Any], skipSynthesize:bool=False, secondPass:bool=False, onLineDone:Optional[Callable[[int], None]]=None) -> SubtitleDict:
+
+    # Create the SSML for every line once, then pack them into as few payloads as possible
+    ssmlList = [(key, build_azure_ssml(cast(str, value[SubsDictKeys.translated_text]), value[SubsDictKeys.duration_ms_buffered], langDict[LangDictKeys.voiceName], langDict[LangDictKeys.languageCode], langDict[LangDictKeys.voiceStyle]))
+                for key, value in subsDict.items()]
+    now = datetime.datetime.now()
+    basePayload:dict = {
+        'displayName': langDict[LangDictKeys.languageCode] + '-' + now.strftime("%Y-%m-%d %H:%M:%S"),
+        'description': 'Batch synthesis of ' + langDict[LangDictKeys.languageCode] + ' subtitles',
+        "inputKind": "SSML",
+        # To use custom voice, see original example code script linked from azure_batch.py
+        "inputs": [],
+        "properties": {
+            "outputFormat": AZURE_BATCH_OUTPUT_FORMAT,
+            "wordBoundaryEnabled": False,
+            "sentenceBoundaryEnabled": False,
+            "concatenateResult": False,
+            "decompressOutputFiles": False
+        },
+    }
+    cacheKeys = {key: tts_cache_key('azure-batch', ssml, basePayload['properties']['outputFormat']) for key, ssml in ssmlList}
+
+    # Clear out the working folder
+    workingFolder = langDict[LangDictKeys.workingFolder]
+    for filename in os.listdir(workingFolder):
+        if not config.debug_mode and os.path.isfile(os.path.join(workingFolder, filename)):
+            os.remove(os.path.join(workingFolder, filename))
+
+    # Lines already in the TTS cache are written straight from it, and only the rest are sent to Azure
+    uncachedSsmlList:list[tuple[int, str]] = []
+    for key, ssml in ssmlList:
+        cachedAudio = get_cached_audio(cacheKeys[key])
+        if cachedAudio is None:
+            uncachedSsmlList.append((key, ssml))
+            continue
+        filePath = os.path.join(workingFolder, f'{str(key)}.{TTS_FILE_EXTENSION}')
+        with open(filePath, 'wb') as f:
+            f.write(cachedAudio)
+        subsDict[key][SubsDictKeys.TTS_FilePath] = filePath
+        if onLineDone is not None:
+            onLineDone(key)
+    if not uncachedSsmlList:
+        print("All lines were found in the TTS cache. Skipping Azure batch synthesis.")
+        finish_tts_cache()
+        return subsDict
 
-        for key, value in tempDict.items():
-            text = tempDict[key][SubsDictKeys.translated_text]
-            duration = tempDict[key][SubsDictKeys.duration_ms_buffered]
-            language = langDict[LangDictKeys.languageCode]
-            voice = langDict[LangDictKeys.voiceName]
-            style = langDict[LangDictKeys.voiceStyle]
+    # The keys of the lines in each payload are kept in input order, to match up the output files
+    payloadList = azure_batch.plan_payloads(basePayload, uncachedSsmlList)
 
-            # Create tag for desired duration of clip
-            durationTag = f'<mstts:audioduration value="{str(duration)}ms"/>'
+    # Tell user if request will be broken up into multiple payloads
+    if len(payloadList) > 1:
+        print(f'Payload will be broken up into {len(payloadList)} requests (due to Azure size limitations).')
 
-            # Create string for sentence pauses, if not default
-            if not config.azure_sentence_pause == 'default':
-                sentencePauseTag = f'<mstts:silence type="Sentenceboundary-exact" value="{str(config.azure_sentence_pause)}ms"/>'
+    # Downloads the zip file of a finished job and extracts the audio files, named by subtitle key
+    def download_and_extract(resultDownloadLink:str, payloadKeys:list[int], payloadIndex:int) -> None:
+        urlResponse = urlopen(resultDownloadLink)
+        zipBytes = urlResponse.read()
+
+        # If debug mode, save zip file to disk
+        if config.debug_mode:
+            zipName = 'azureBatch' if secondPass == False else 'azureBatchPass2'
+            if len(payloadList) > 1:
+                zipName += f'_{payloadIndex+1}'
+            with open(os.path.join(workingFolder, zipName + '.zip'), 'wb') as f:
+                f.write(zipBytes)
+
+        zipdata = zipfile.ZipFile(io.BytesIO(zipBytes))
+        for file in zipdata.infolist():
+            if "json" in file.filename: # summary.json and any other info files
+                continue
+            # Output files are named by the 1-based index of their input in the payload, such as 0001.mp3 or 0001.wav
+            try:
+                inputIndex = int(os.path.splitext(os.path.basename(file.filename))[0]) - 1
+                key = payloadKeys[inputIndex]
+            except (ValueError, IndexError):
+                print(f"WARNING: Unexpected file in Azure batch synthesis results: {file.filename}")
+                continue
+            audio = zipdata.read(file)
+            filePath = os.path.join(workingFolder, f'{str(key)}.{TTS_FILE_EXTENSION}')
+            with open(filePath, 'wb') as f:
+                f.write(audio)
+            subsDict[key][SubsDictKeys.TTS_FilePath] = filePath
+            put_cached_audio(cacheKeys[key], audio)
+            if onLineDone is not None:
+                onLineDone(key)
+
+    # Submit every payload up front, so Azure works on all of them at the same time
+    jobs:dict[str, tuple[list[int], int]] = {} # Job ID -> (keys in payload, payload index)
+    for payloadIndex, (payload, payloadKeys) in enumerate(payloadList):
+        job_id = azure_batch.submit_synthesis(payload)
+        if job_id is not None:
+            jobs[job_id] = (payloadKeys, payloadIndex)
+        else:
+            print(f'ERROR: Failed to submit Azure batch synthesis job {payloadIndex+1} of {len(payloadList)}. Refer to the error message above.')
+
+    # Poll all jobs together, checking each one less often the longer it runs. Each job's files are downloaded while the others are still being polled
+    pollDelays = {job_id: azure_batch.POLL_INITIAL_DELAY for job_id in jobs}
+    nextPollTimes = {job_id: time.monotonic() + delay for job_id, delay in pollDelays.items()}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as downloadExecutor:
+        downloads:list[concurrent.futures.Future[None]] = []
+        while nextPollTimes:
+            job_id = min(nextPollTimes, key=lambda jobID: nextPollTimes[jobID])
+            time.sleep(max(0.0, nextPollTimes[job_id] - time.monotonic()))
+
+            # Get status
+            response = azure_batch.get_synthesis(job_id)
+            if not response:
+                if utils.choice("Failed to get status of Azure batch synthesis job. Would you like to retry?") == True:
+                    nextPollTimes[job_id] = time.monotonic()
+                else:
+                    del nextPollTimes[job_id]
+                continue
+            status = response.json()['status']
+
+            if status == 'Succeeded':
+                print('Batch synthesis job succeeded. Downloading audio files...')
+                del nextPollTimes[job_id]
+                payloadKeys, payloadIndex = jobs[job_id]
+                downloads.append(downloadExecutor.submit(contextvars.copy_context().run, download_and_extract, response.json()['outputs']['result'], payloadKeys, payloadIndex))
+            elif status == 'Failed':
+                errorCode = response.json()['properties']['error']['code']
+                errorMessage = response.json()['properties']['error']['message']
+                print('ERROR: Batch synthesis job failed!')
+                print("Reason:" + response.reason)
+                print("Error Code: " + errorCode)
+                print("Error Message: " + errorMessage)
+                print()
+                del nextPollTimes[job_id]
             else:
-                sentencePauseTag = ''
+                pollDelays[job_id] = azure_batch.next_poll_delay(pollDelays[job_id])
+                nextPollTimes[job_id] = time.monotonic() + pollDelays[job_id]
+                print(f'Waiting for Azure batch synthesis jobs to finish. Status: [{status}] - Jobs remaining: {len(nextPollTimes)}   ', end="\r")
 
-            # Create string for comma pauses, if not default
-            if not config.azure_comma_pause == 'default':
-                commaPauseTag = f'<mstts:silence type="Comma-exact" value="{str(config.azure_comma_pause)}ms"/>'
-            else:
-                commaPauseTag = ''
-                
-                # Create string for style, if not default
-            if not style == 'default':
-                styleTagStart = f'<mstts:express-as style="{style}">'
-                styleTagEnd = f'</mstts:express-as>'
-            else:
-                styleTagStart = ''
-                styleTagEnd = ''
-
-            # Set string for tag to set leading and trailing silence times to zero
-            leadSilenceTag = '<mstts:silence  type="Leading-exact" value="0ms"/>'
-            tailSilenceTag = '<mstts:silence  type="Tailing-exact" value="0ms"/>'
-            
-            # Need to escape for XML, but do it before we add our own SSML Tags
-            text = html.escape(text)
-
-            # Process text using pronunciation customization set by user
-            text = add_all_pronunciation_overrides(text)
-
-            # Create the SSML for each subtitle
-            ssml = f"<speak version='1.0' xml:lang='{language}' xmlns='http://www.w3.org/2001/10/synthesis' " \
-            "xmlns:mstts='http://www.w3.org/2001/mstts'>" \
-            f"<voice name='{voice}'>{sentencePauseTag}{commaPauseTag}{durationTag}{leadSilenceTag}{tailSilenceTag}{styleTagStart}" \
-            f"{text}{styleTagEnd}</voice></speak>"
-            ssmlJson.append({"content": ssml})
-
-            # Construct request payload with SSML
-            # Reconstruct payload with every loop with new SSML so that the payload size is accurate
-            now = datetime.datetime.now()
-            pendingPayload:dict = {
-                'displayName': langDict[LangDictKeys.languageCode] + '-' + now.strftime("%Y-%m-%d %H:%M:%S"),
-                'description': 'Batch synthesis of ' + langDict[LangDictKeys.languageCode] + ' subtitles',
-                "inputKind": "SSML",
-                # To use custom voice, see original example code script linked from azure_batch.py
-                "inputs": ssmlJson,
-                "properties": {
-                    "outputFormat": "audio-48khz-192kbitrate-mono-mp3",
-                    "wordBoundaryEnabled": False,
-                    "sentenceBoundaryEnabled": False,
-                    "concatenateResult": False,
-                    "decompressOutputFiles": False
-                },
-            }
-            # Azure TTS Batch requests require payload must be under 500 kilobytes, so check payload is under 500,000 bytes. Not sure if they actually mean kibibytes, assume worst case.
-            # Payload will be formatted as json so must account for that too by doing json.dumps(), otherwise calculated size will be inaccurate
-            payloadSizeInBytes:int = len(str(json.dumps(pendingPayload)).encode('utf-8'))
-            
-            # Until the payload is too large, do this to keep updating/remaking the final 'payload' variable
-            if payloadSizeInBytes < 495000 and len(ssmlJson) < 995: # Leave some room for anything unexpected. Also number of inputs must be below 1000
-                payload = copy.deepcopy(pendingPayload) # Must make deepycopy otherwise ssmlJson will be updated in both instead of just pendingPayload
-                # Remove entry from remainingEntriesDict if it was added to payload
-                remainingEntriesDict.pop(key)
-            # If payload would be too large, ignore the last-added entry (don't do pop key), and just return the most recent previous version of the payload that was within size limits
-            else:
-                return payload, remainingEntriesDict
+        for download in downloads:
+            download.result()
+    finish_tts_cache()
+    return subsDict
 
-        # If it reaches here, then everything fit, so return the payload
-        return payload, remainingEntriesDict
-    # ------------------------- End create_request_payload() -----------------------------------
 
+# ======================================== Deduplication ================================================
+# Videos often repeat the same sentences, so lines that would send exactly the same request are only synthesized once
+# The voice and other settings are the same for every line of a language, so only the parts that differ per line are compared
 
-    # Create payloads, split into multiple if necessary
-    payloadList = []
-    remainingPayloadEntriesDict = dict(subsDict) # Will remove entries as they are added to payloads
-    while len(remainingPayloadEntriesDict) > 0:
-        payloadToAppend, remainingPayloadEntriesDict = create_request_payload(remainingPayloadEntriesDict)
-        payloadList.append(payloadToAppend)
-    
-    # Tell user if request will be broken up into multiple payloads
-    if len(payloadList) > 1:
-        print(f'Payload will be broken up into {len(payloadList)} requests (due to Azure size limitations).')
+deduplicatedRequestCount = 0 # Total for the whole run, shown in the summary at the end
+_dedupLock = threading.Lock()
 
-    # Use to keep track of filenames downloaded via separate zip files. WIll remove as they are downloaded
-    remainingDownloadedEntriesList = list(subsDict.keys())
+def request_signature(entry:SubtitleEntry, secondPass:bool) -> tuple:
+    text = entry[SubsDictKeys.translated_text]
+    if cloudConfig.tts_service == TTSService.AZURE:
+        return (text, entry[SubsDictKeys.duration_ms_buffered]) # Duration is part of the SSML
+    elif cloudConfig.tts_service == TTSService.GOOGLE:
+        return (text, entry[SubsDictKeys.speed_factor] if secondPass else entry.get(SubsDictKeys.first_pass_speaking_rate, 1.0))
+    return (text,)
 
-    # Clear out workingFolder
-    for filename in os.listdir('workingFolder'):
-        if not config.debug_mode:
-            os.remove(os.path.join('workingFolder', filename))
+# Returns a dictionary with only the first line of each group of identical requests, and which other keys are repeats of each of those
+def deduplicate_lines(subsDict:SubtitleDict, secondPass:bool=False) -> tuple[SubtitleDict, dict[int, list[int]]]:
+    uniqueDict:SubtitleDict = {}
+    duplicateKeys:dict[int, list[int]] = {}
+    firstKeyForSignature:dict[tuple, int] = {}
+    for key, value in subsDict.items():
+        firstKey = firstKeyForSignature.setdefault(request_signature(value, secondPass), key)
+        if firstKey == key:
+            uniqueDict[key] = value
+        else:
+            duplicateKeys.setdefault(firstKey, []).append(key)
+    return uniqueDict, duplicateKeys
+
+# Gives each repeat of a line its own copy of the line's audio file, so later steps can treat every line the same
+def copy_audio_to_duplicates(subsDict:SubtitleDict, firstKey:int, keys:list[int], workingFolder:str) -> None:
+    sourcePath = subsDict[firstKey].get(SubsDictKeys.TTS_FilePath)
+    for key in keys:
+        if sourcePath is None or not os.path.isfile(str(sourcePath)):
+            if sourcePath is not None:
+                subsDict[key][SubsDictKeys.TTS_FilePath] = sourcePath # "Failed"
+            continue
+        filePath = os.path.join(workingFolder, f'{str(key)}.{TTS_FILE_EXTENSION}')
+        shutil.copyfile(str(sourcePath), filePath)
+        subsDict[key][SubsDictKeys.TTS_FilePath] = filePath
 
-    # Loop through payloads and submit to Azure
-    for payload in payloadList:
-        # Reset job_id from previous loops
-        job_id = None
-        
-        # Send request to Azure
-        job_id = azure_batch.submit_synthesis(payload)
+# Synthesizes every line using whichever method fits the TTS service and settings. Identical requests are only made once
+# If onLineDone is given, it's called with the key of each line as soon as its audio file is ready (or it failed), possibly from another thread
+def synthesize_all(subsDict:SubtitleDict, langDict:dict[LangDictKeys, Any], skipSynthesize:bool=False, secondPass:bool=False, onLineDone:Optional[Callable[[int], None]]=None) -> SubtitleDict:
+    global deduplicatedRequestCount
+    # Google lets the speaking rate be set, so the first pass can already aim for the right length if the voice's speaking rate has been learned
+    if not secondPass and not skipSynthesize and config.learn_speaking_rate and cloudConfig.tts_service == TTSService.GOOGLE:
+        speaking_rate.set_first_pass_speaking_rates(subsDict, langDict)
+    uniqueDict, duplicateKeys = (subsDict, {}) if skipSynthesize else deduplicate_lines(subsDict, secondPass)
+    dedupCount = len(subsDict) - len(uniqueDict)
+    if dedupCount > 0:
+        print(f"{dedupCount} lines are repeats of other lines, so only {len(uniqueDict)} unique lines will be synthesized.")
+        with _dedupLock:
+            deduplicatedRequestCount += dedupCount
+
+    # Repeats of a line get their copy of the audio as soon as the line is done, so they're ready at the same time as it
+    def line_done(key:int) -> None:
+        repeatKeys = duplicateKeys.get(key, [])
+        copy_audio_to_duplicates(subsDict, key, repeatKeys, langDict[LangDictKeys.workingFolder])
+        if onLineDone is not None:
+            for doneKey in [key, *repeatKeys]:
+                onLineDone(doneKey)
+
+    if cloudConfig.batch_tts_synthesize == True and cloudConfig.tts_service == TTSService.AZURE:
+        synthesize_dictionary_batch(uniqueDict, langDict, skipSynthesize=skipSynthesize, secondPass=secondPass, onLineDone=line_done)
+    elif cloudConfig.tts_service == TTSService.ELEVENLABS:
+        run_async(synthesize_dictionary_async(uniqueDict, langDict, skipSynthesize=skipSynthesize, secondPass=secondPass, onLineDone=line_done))
+    else:
+        synthesize_dictionary(uniqueDict, langDict, skipSynthesize=skipSynthesize, secondPass=secondPass, onLineDone=line_done)
+    return subsDict
 
-        # Wait for job to finish
-        if job_id is not None:
-            status = "Running"
-            resultDownloadLink = None
-            
-            while True: # Must use break to exit loop
-                # Get status
-                response = azure_batch.get_synthesis(job_id)
-                if response:
-                    status = response.json()['status']
-                else:
-                    if utils.choice("Failed to get status of Azure batch synthesis job. Would you like to retry?") == True:
-                        continue
-                    else:
-                        break
-                    
-                if status and status == 'Succeeded':
-                    print('Batch synthesis job succeeded')
-                    resultDownloadLink = response.json()['outputs']['result']
-                    break
-                elif status and status == 'Failed':
-                    errorCode = response.json()['properties']['error']['code']
-                    errorMessage = response.json()['properties']['error']['message']
-                    print('ERROR: Batch synthesis job failed!')
-                    print("Reason:" + response.reason)
-                    print("Error Code: " + errorCode)
-                    print("Error Message: " + errorMessage)
-                    print()
-                    break
+# Runs synthesize_all in the background, and yields the keys of the lines in subtitle order as soon as each one's audio file is ready
+# This lets the audio of the first lines be trimmed and stretched while the rest are still being synthesized
+# At most maxQueued finished lines are waiting to be picked up at a time. After that synthesis waits, so it never gets too far ahead of the clip processing
+def synthesize_all_streaming(subsDict:SubtitleDict, langDict:dict[LangDictKeys, Any], skipSynthesize:bool=False, maxQueued:int=64) -> Iterator[int]:
+    finishedKeys:queue.Queue[Optional[int]] = queue.Queue(maxsize=maxQueued)
+    stopped = threading.Event() # Set if the lines stop being picked up, so synthesis doesn't wait forever
+    errors:list[BaseException] = []
+
+    def put_finished_key(key:Optional[int]) -> None:
+        while not stopped.is_set():
+            try:
+                finishedKeys.put(key, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def run_synthesis() -> None:
+        try:
+            synthesize_all(subsDict, langDict, skipSynthesize=skipSynthesize, onLineDone=put_finished_key)
+        except BaseException as e: # Includes SystemExit from the error handling
+            errors.append(e)
+        finally:
+            put_finished_key(None)
+
+    synthesisThread = threading.Thread(target=contextvars.copy_context().run, args=(run_synthesis,), daemon=True)
+    synthesisThread.start()
+    readyKeys:set[int] = set()
+    synthesisFinished = False
+    try:
+        for key in subsDict:
+            # Finished lines can arrive in any order, so keep track of them until it's their turn
+            while key not in readyKeys and not synthesisFinished:
+                finishedKey = finishedKeys.get()
+                if finishedKey is None:
+                    synthesisFinished = True
                 else:
-                    print(f'Waiting for Azure batch synthesis job to finish. Status: [{status}]')
-                    time.sleep(5) # 5 Seconds
-            
-            # Download resultig zip file
-            if resultDownloadLink is not None:
-                print("Downloading audio files...")
-                # Download zip file
-                urlResponse = urlopen(resultDownloadLink)
-
-                # If debug mode, save zip file to disk
-                if config.debug_mode:
-                    if secondPass == False:
-                        zipName = 'azureBatch.zip'
-                    else:
-                        zipName = 'azureBatchPass2.zip'
-
-                    zipPath = os.path.join('workingFolder', zipName)
-                    with open(zipPath, 'wb') as f:
-                        f.write(urlResponse.read())
-                    # Reset urlResponse so it can be read again
-                    urlResponse = urlopen(resultDownloadLink)
-                # Process zip file    
-                virtualResultZip = io.BytesIO(urlResponse.read())
-                zipdata = zipfile.ZipFile(virtualResultZip)
-                zipinfos = zipdata.infolist()
-
-                # Reorder zipinfos so the file names are in alphanumeric order
-                zipinfos.sort(key=lambda x: x.filename)
-
-                # Only extract necessary files, and rename them while doing so
-                for file in zipinfos:
-                    if file.filename == "summary.json":
-                        #zipdata.extract(file, 'workingFolder') # For debugging
-                        pass
-                    elif "json" not in file.filename:
-                        # Rename file to match first entry in remainingDownloadedEntriesDict, then extract
-                        currentFileNum = remainingDownloadedEntriesList[0]
-                        file.filename = str(currentFileNum) + '.mp3'
-                        #file.filename = file.filename.lstrip('0')
-
-                        # Add file path to subsDict then remove from remainingDownloadedEntriesList
-                        subsDict[currentFileNum][SubsDictKeys.TTS_FilePath] = os.path.join('workingFolder', str(currentFileNum)) + '.mp3'
-                        # Extract file
-                        zipdata.extract(file, 'workingFolder')
-                        # Remove entry from remainingDownloadedEntriesList
-                        remainingDownloadedEntriesList.pop(0)
-    return subsDict
+                    readyKeys.add(finishedKey)
+            if errors:
+                raise errors[0]
+            yield key # Lines that were never reported as done are still yielded once synthesis is finished, so missing files get reported when they're checked
+    finally:
+        stopped.set()
+    synthesisThread.join()
 
 
-def synthesize_dictionary_batch(subsDict:SubtitleDict, langDict:dict[LangDictKeys, Any], skipSynthesize:bool=False, secondPass:bool=False) -> SubtitleDict:
+def synthesize_dictionary_batch(subsDict:SubtitleDict, langDict:dict[LangDictKeys, Any], skipSynthesize:bool=False, secondPass:bool=False, onLineDone:Optional[Callable[[int], None]]=None) -> SubtitleDict:
     if not skipSynthesize:
         if cloudConfig.tts_service == TTSService.AZURE:
-            subsDict = synthesize_text_azure_batch(subsDict, langDict, skipSynthesize, secondPass)
+            subsDict = synthesize_text_azure_batch(subsDict, langDict, skipSynthesize, secondPass, onLineDone)
         else:
             print('ERROR: Batch TTS only supports azure at this time')
             input('Press enter to exit...')
             exit()
     return subsDict
 
-async def synthesize_dictionary_async(subsDict:SubtitleDict, langDict:dict[LangDictKeys, Any], skipSynthesize:bool=False, max_concurrent_jobs:int=2, secondPass:bool=False) -> SubtitleDict:
-    semaphore = asyncio.Semaphore(max_concurrent_jobs)
+# How many requests run at once is controlled by ELEVENLABS_CONCURRENCY_LIMITER, which is shared with any other languages running at the same time
+async def synthesize_dictionary_async(subsDict:SubtitleDict, langDict:dict[LangDictKeys, Any], skipSynthesize:bool=False, secondPass:bool=False, onLineDone:Optional[Callable[[int], None]]=None) -> SubtitleDict:
     lock = asyncio.Lock()
     progress = 0
     total_tasks = len(subsDict)
     errorsOccured = False
 
     print("Beginning Text-To-Speech Audio Synthesis...")
+    session = await get_elevenlabs_session()
 
     async def synthesize_and_save(key, value):
         nonlocal progress
 
-        # Use this to set max concurrent jobs
-        async with semaphore:
-            audio = await synthesize_text_elevenlabs_async_http(
-                value[SubsDictKeys.translated_text], 
-                langDict[LangDictKeys.voiceName], 
-                langDict[LangDictKeys.voiceModel]
-            )
-
-            if audio:
-                filePath = os.path.join('workingFolder', f'{str(key)}.mp3')
-                with open(filePath, "wb") as out:
-                    out.write(audio)
-                subsDict[key][SubsDictKeys.TTS_FilePath] = filePath
-            else:
-                nonlocal errorsOccured
-                errorsOccured = True
-                subsDict[key][SubsDictKeys.TTS_FilePath] = "Failed"
+        audio = await synthesize_text_elevenlabs_async_http(
+            value[SubsDictKeys.translated_text], 
+            langDict[LangDictKeys.voiceName], 
+            langDict[LangDictKeys.voiceModel],
+            session=session
+        )
+
+        if audio:
+            filePath = os.path.join(langDict[LangDictKeys.workingFolder], f'{str(key)}.{TTS_FILE_EXTENSION}')
+            with open(filePath, "wb") as out:
+                out.write(audio)
+            subsDict[key][SubsDictKeys.TTS_FilePath] = filePath
+        else:
+            nonlocal errorsOccured
+            errorsOccured = True
+            subsDict[key][SubsDictKeys.TTS_FilePath] = "Failed"
+        # Runs in a thread, because it may wait and must not block the event loop shared by every language
+        if onLineDone is not None:
+            await asyncio.to_thread(onLineDone, key)
 
         # Update and display progress after task completion
         async with lock:
@@ -572,66 +835,80 @@ async def synthesize_dictionary_async(subsDict:SubtitleDict, langDict:dict[LangD
         print("Warning: Errors occurred during TTS synthesis. Please check any error messages above for details.")
     else:
         print("Synthesis Finished")
+    if cloudConfig.elevenlabs_adaptive_concurrency and tasks:
+        save_limit(ELEVENLABS_CONCURRENCY_FILE, ELEVENLABS_ACCOUNT_KEY, ELEVENLABS_CONCURRENCY_LIMITER.currentLimit)
+        print(f"ElevenLabs concurrent requests: {ELEVENLABS_CONCURRENCY_LIMITER.currentLimit} (Saved for next time)")
+    finish_tts_cache()
     return subsDict
 
 
-def synthesize_dictionary(subsDict:SubtitleDict, langDict:dict[LangDictKeys, Any], skipSynthesize:bool=False, secondPass:bool=False) -> SubtitleDict:
-    for key, value in subsDict.items():
-        # TTS each subtitle text, write to file, write filename into dictionary
-        filePath = os.path.join('workingFolder', f'{str(key)}.mp3')
-        filePathStem = os.path.join('workingFolder', f'{str(key)}')
-        if not skipSynthesize:
-
-            duration = value[SubsDictKeys.duration_ms_buffered]
-
-            if secondPass:
-                # Get speed factor from subsDict
-                speedFactor = cast(float, subsDict[key][SubsDictKeys.speed_factor])
-            else:
-                speedFactor = float(1.0)
-
-            # Prepare output location. If folder doesn't exist, create it
-            if not os.path.exists(os.path.dirname(filePath)):
-                try:
-                    os.makedirs(os.path.dirname(filePath))
-                except OSError:
-                    print("Error creating directory")
-
-            # If Google TTS, use Google API
-            if cloudConfig.tts_service == TTSService.GOOGLE:
-                audio = synthesize_text_google(cast(str, value[SubsDictKeys.translated_text]), speedFactor, langDict[LangDictKeys.voiceName], langDict[LangDictKeys.voiceGender], langDict[LangDictKeys.languageCode])
-                with open(filePath, "wb") as out:
+# Synthesizes the lines using a pool of threads, and saves the audio for each one to the working folder
+# synthesizeLine is given the subtitle entry and an object for storing anything each thread needs its own copy of, and returns the audio bytes
+def synthesize_dictionary_concurrent(subsDict:SubtitleDict, synthesizeLine:Callable[[SubtitleEntry, threading.local], bytes], maxConcurrent:int, workingFolder:str, secondPass:bool=False, onLineDone:Optional[Callable[[int], None]]=None) -> SubtitleDict:
+    threadState = threading.local()
+    lock = threading.Lock()
+    progress = 0
+    errorsOccured = False
+    os.makedirs(workingFolder, exist_ok=True)
+
+    def synthesize_and_save(key:int, value:SubtitleEntry) -> None:
+        nonlocal progress, errorsOccured
+        filePath = os.path.join(workingFolder, f'{str(key)}.{TTS_FILE_EXTENSION}')
+        filePathStem = os.path.join(workingFolder, f'{str(key)}')
+
+        audio = synthesizeLine(value, threadState)
+        if audio:
+            with open(filePath, "wb") as out:
+                out.write(audio)
+            # If debug mode, write to files TTS - Doesn't write for 1st pass because it's already written as [number].mp3 (or .wav)
+            if config.debug_mode and secondPass == True:
+                with open(filePathStem+f"_pass2.{TTS_FILE_EXTENSION}", "wb") as out:
                     out.write(audio)
-                
-                # If debug mode, write to files TTS - Doesn't write for 1st pass because it's already written as [number].mp3
-                # if config.debug_mode and secondPass == False:
-                #     with open(filePathStem+"_pass1.mp3", "wb") as out:
-                #         out.write(audio)
-                if config.debug_mode and secondPass == True:
-                    with open(filePathStem+"_pass2.mp3", "wb") as out:
-                        out.write(audio)
-
-            # If Azure TTS, use Azure API
-            elif cloudConfig.tts_service == TTSService.AZURE:
-                # Audio variable is an AudioDataStream object
-                audio = synthesize_text_azure(cast(str, value[SubsDictKeys.translated_text]), duration, langDict[LangDictKeys.voiceName], langDict[LangDictKeys.languageCode], langDict[LangDictKeys.voiceStyle])
-                # Save to file using save_to_wav_file method of audio object
-                audio.save_to_wav_file(filePath)
-                
-                # If debug mode, write to files TTS - Doesn't write for 1st pass because it's already written as [number].mp3
-                # if config.debug_mode and secondPass == False:
-                #     audio.save_to_wav_file(filePathStem+"_pass1.mp3")
-                if config.debug_mode and secondPass == True:
-                    audio.save_to_wav_file(filePathStem+"_pass2.mp3")
+            value[SubsDictKeys.TTS_FilePath] = filePath
+        else:
+            errorsOccured = True
+            value[SubsDictKeys.TTS_FilePath] = "Failed"
+        if onLineDone is not None:
+            onLineDone(key)
 
-        subsDict[key][SubsDictKeys.TTS_FilePath] = filePath
+        with lock:
+            progress += 1
+            if not secondPass:
+                print(f" Synthesizing TTS Line: {progress} of {len(subsDict)}", end="\r")
+            else:
+                print(f" Synthesizing TTS Line (2nd Pass): {progress} of {len(subsDict)}", end="\r")
 
-        # Get key index
-        keyIndex = list(subsDict.keys()).index(key)
-        # Print progress and overwrite line next time
-        if not secondPass:
-            print(f" Synthesizing TTS Line: {keyIndex+1} of {len(subsDict)}", end="\r")
-        else:
-            print(f" Synthesizing TTS Line (2nd Pass): {keyIndex+1} of {len(subsDict)}", end="\r")
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, maxConcurrent)) as executor:
+        # Each thread copies the context, so its messages are printed wherever the language's messages go
+        futures = [executor.submit(contextvars.copy_context().run, synthesize_and_save, key, value) for key, value in subsDict.items()]
+        for future in futures:
+            future.result()
     print("                                               ") # Clear the line
+    if errorsOccured:
+        print("Warning: Errors occurred during TTS synthesis. Please check any error messages above for details.")
+    finish_tts_cache()
+    return subsDict
+
+def synthesize_dictionary(subsDict:SubtitleDict, langDict:dict[LangDictKeys, Any], skipSynthesize:bool=False, secondPass:bool=False, onLineDone:Optional[Callable[[int], None]]=None) -> SubtitleDict:
+    # If Google TTS, use Google API. The shared rate limiter spreads requests out to just under the quota
+    if not skipSynthesize and cloudConfig.tts_service == TTSService.GOOGLE:
+        def synthesize_line_google(value:SubtitleEntry, threadState:threading.local) -> bytes:
+            if not hasattr(threadState, 'http'):
+                threadState.http = auth.new_google_http()
+            speedFactor = cast(float, value[SubsDictKeys.speed_factor]) if secondPass else float(value.get(SubsDictKeys.first_pass_speaking_rate, 1.0))
+            return synthesize_text_google(cast(str, value[SubsDictKeys.translated_text]), speedFactor, langDict[LangDictKeys.voiceName], langDict[LangDictKeys.voiceGender], langDict[LangDictKeys.languageCode], http=threadState.http)
+        return synthesize_dictionary_concurrent(subsDict, synthesize_line_google, cloudConfig.google_tts_max_concurrent, langDict[LangDictKeys.workingFolder], secondPass, onLineDone)
+
+    # If Azure TTS, use Azure API. Each request uses a synthesizer from the pool, which already has its connection open
+    elif not skipSynthesize and cloudConfig.tts_service == TTSService.AZURE:
+        pool = get_azure_synthesizer_pool()
+        def synthesize_line_azure(value:SubtitleEntry, threadState:threading.local) -> bytes:
+            return synthesize_text_azure(cast(str, value[SubsDictKeys.translated_text]), value[SubsDictKeys.duration_ms_buffered], langDict[LangDictKeys.voiceName], langDict[LangDictKeys.languageCode], langDict[LangDictKeys.voiceStyle], pool)
+        return synthesize_dictionary_concurrent(subsDict, synthesize_line_azure, cloudConfig.azure_tts_max_concurrent, langDict[LangDictKeys.workingFolder], secondPass, onLineDone)
+
+    # Otherwise synthesis is skipped, so use the files that should already be in the working folder
+    for key in subsDict:
+        subsDict[key][SubsDictKeys.TTS_FilePath] = os.path.join(langDict[LangDictKeys.workingFolder], f'{str(key)}.{TTS_FILE_EXTENSION}')
+        if onLineDone is not None:
+            onLineDone(key)
     return subsDict
@@ -0,0 +1,115 @@
+import json
+import time
+import random
+import asyncio
+import datetime
+import threading
+import email.utils
+from typing import Optional
+
+import Scripts.utils as utils
+
+# Limits how many requests are in flight at once, and adjusts the limit to what the service can take (additive increase, multiplicative decrease)
+# Every request that succeeds while the limit is fully used raises the limit a little, so it goes up by about one for each round of requests
+# When the service says it's overloaded, the limit is halved and no new requests are started until it says to retry
+# Only one halving happens for each overload: requests that were already in flight when the limit was lowered don't lower it again
+# Meant to be used from a single event loop, which may be shared by any number of languages
+
+class AdaptiveConcurrencyLimiter:
+    def __init__(self, initialLimit:int, maxLimit:int, adaptive:bool=True, name:str='requests'):
+        self.maxLimit = max(1, maxLimit)
+        self.limit = float(min(self.maxLimit, max(1, initialLimit)))
+        self.adaptive = adaptive
+        self.name = name # Used in the messages printed when the limit is lowered
+        self.active = 0
+        self.pausedUntil = 0.0 # time.monotonic() before which no new requests are started
+        self.decreaseCount = 0
+        self._condition:Optional[asyncio.Condition] = None
+
+    @property
+    def currentLimit(self) -> int:
+        return max(1, int(self.limit))
+
+    # Created on first use, so it belongs to the event loop the requests run on
+    def _get_condition(self) -> asyncio.Condition:
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    # Waits until another request may start. Returns a ticket that must be passed to record_overload if this request gets an overload response
+    async def acquire(self) -> int:
+        condition = self._get_condition()
+        async with condition:
+            while True:
+                pauseTime = self.pausedUntil - time.monotonic()
+                if pauseTime > 0:
+                    try:
+                        await asyncio.wait_for(condition.wait(), pauseTime)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                if self.active < self.currentLimit:
+                    self.active += 1
+                    return self.decreaseCount
+                await condition.wait()
+
+    async def release(self) -> None:
+        condition = self._get_condition()
+        async with condition:
+            self.active -= 1
+            condition.notify_all()
+
+    # Call before release, so it can tell whether the limit was fully used
+    def record_success(self) -> None:
+        if self.adaptive and self.active >= self.currentLimit and self.limit < self.maxLimit:
+            self.limit = min(self.maxLimit, self.limit + 1 / self.limit)
+
+    def record_overload(self, ticket:int, retryAfter:float) -> None:
+        self.pausedUntil = max(self.pausedUntil, time.monotonic() + retryAfter)
+        if self.adaptive and ticket == self.decreaseCount:
+            self.decreaseCount += 1
+            previousLimit = self.currentLimit
+            self.limit = max(1.0, self.limit / 2)
+            if self.currentLimit < previousLimit:
+                print(f"\n  > Too many {self.name} at once, lowering the limit from {previousLimit} to {self.currentLimit}")
+
+# Reads a Retry-After header, which can be a number of seconds or a date. Returns None if it's missing or can't be read
+def parse_retry_after(value:Optional[str], maxSeconds:float=120) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            retryDate = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if retryDate.tzinfo is None:
+            retryDate = retryDate.replace(tzinfo=datetime.timezone.utc)
+        seconds = (retryDate - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+    return min(maxSeconds, max(0.0, seconds))
+
+# Exponential backoff with jitter, so requests that failed together don't all retry at the same moment
+def backoff_delay(attempt:int, baseSeconds:float=1, maxSeconds:float=60) -> float:
+    return min(maxSeconds, baseSeconds * 2 ** attempt) * random.uniform(0.5, 1)
+
+# The limit found on a previous run is saved, so the next run can start from it instead of finding it again
+_savedLimitsLock = threading.Lock()
+
+def load_saved_limit(filePath:str, accountKey:str) -> Optional[int]:
+    try:
+        with open(filePath, 'r', encoding='utf-8') as f:
+            return int(json.load(f)[accountKey])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+def save_limit(filePath:str, accountKey:str, limit:int) -> None:
+    # Other languages may be saving their limit at the same time, so the file is read, updated and written by one at a time
+    with _savedLimitsLock:
+        try:
+            with open(filePath, 'r', encoding='utf-8') as f:
+                savedLimits = json.load(f)
+        except (OSError, ValueError):
+            savedLimits = {}
+        savedLimits[accountKey] = limit
+        utils.write_json_atomic(filePath, savedLimits)
@@ -1,230 +1,84 @@
-import soundfile
-import pyrubberband
 import pathlib
 import os
-import io
-import math
-from platform import system as sysPlatform
 
 from Scripts.shared_imports import *
 import Scripts.TTS as TTS
+import Scripts.audio_mixer as audio_mixer
+import Scripts.clip_processing as clip_processing
 
-from pydub import AudioSegment
-from pydub.silence import detect_leading_silence
-from typing import Any
+from typing import Any, Container, Iterable, Iterator, Optional, cast
 import langcodes
-import subprocess
-
-# import numpy array type for audioObj from SoundFile
-from numpy import ndarray
-
-# Set working folder
-workingFolder = "workingFolder"
-
-# If macOS, add current working directory to path for session for rubberband
-if sysPlatform() == "Darwin":
-    os.environ['PATH'] += os.pathsep + os.getcwd()
-
-def trim_clip(inputSound: AudioSegment) -> AudioSegment:
-    trim_leading_silence = lambda x: x[detect_leading_silence(x):]
-    trim_trailing_silence = lambda x: trim_leading_silence(x.reverse()).reverse()
-    strip_silence = lambda x: trim_trailing_silence(trim_leading_silence(x))
-    
-    return strip_silence(inputSound)
-
-# Function to insert audio into canvas at specific point
-def insert_audio(canvas, audioToOverlay, startTimeMs):
-    # Create a copy of the canvas
-    canvasCopy = canvas
-    # Overlay the audio onto the copy
-    canvasCopy = canvasCopy.overlay(audioToOverlay, position=int(startTimeMs))
-    # Return the copy
-    return canvasCopy
+from Scripts.disk_cache import DiskCache, CacheStats
+from Scripts.incremental_render import IncrementalRenderStore
+import Scripts.speaking_rate as speaking_rate
 
 # Function to create a canvas of a specific duration in miliseconds
-def create_canvas(canvasDuration, frame_rate=48000):
-    canvas = AudioSegment.silent(duration=canvasDuration, frame_rate=frame_rate)
+def create_canvas(canvasDuration, frame_rate=config.canvas_sample_rate) -> audio_mixer.MixCanvas:
+    canvas = audio_mixer.MixCanvas(canvasDuration, frameRate=frame_rate)
     return canvas
 
-def get_speed_factor(subsDict, trimmedAudio, desiredDuration, num):
-    virtualTempFile = AudioSegment.from_file(trimmedAudio, format="wav")
-    rawDuration = virtualTempFile.duration_seconds
-    trimmedAudio.seek(0) # This MUST be done to reset the file pointer to the start of the file, otherwise will get errors next time try to access the virtual files
-    # Calculate the speed factor, put into dictionary
-    desiredDuration = float(desiredDuration)
-    speedFactor = (rawDuration*1000) / desiredDuration
-    subsDict[num][SubsDictKeys.speed_factor] = speedFactor
-    return subsDict
-
-def stretch_with_rubberband(y, sampleRate, speedFactor):
-    rubberband_streched_audio = pyrubberband.time_stretch(y, sampleRate, speedFactor, rbargs={'--fine': '--fine'}) # Need to add rbarges in weird way because it demands a dictionary of two values
-    return rubberband_streched_audio
-
-def stretch_with_ffmpeg(audioInput, speed_factor):
-    min_speed_factor = 0.5
-    max_speed_factor = 100.0
-    filter_loop_count = 1
-
-    # Validate speed_factor and calculate filter_loop_count
-    if speed_factor < min_speed_factor:
-        filter_loop_count = math.ceil(math.log(speed_factor) / math.log(min_speed_factor))
-        speed_factor = speed_factor ** (1 / filter_loop_count)
-        if speed_factor < 0.001:
-            raise ValueError(f"ERROR: Speed factor is extremely low, and likely an error. It was: {speed_factor}")
-    elif speed_factor > max_speed_factor:
-        raise ValueError(f"ERROR: Speed factor cannot be over 100. It was {speed_factor}.")
-
-    # Prepare ffmpeg command
-    command = ['ffmpeg', '-i', 'pipe:0', '-filter:a', f'atempo={speed_factor}', '-f', 'wav', 'pipe:1']
-    process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-    # Pass the audio data to ffmpeg and read the processed data
-    out, err = process.communicate(input=audioInput.getvalue())
-
-    # Check for errors
-    if process.returncode != 0:
-        raise Exception(f'ffmpeg error: {err.decode()}')
-
-    # Convert the output bytes to a NumPy array to be compatible with rest of the program
-    # audio_data = numpy.frombuffer(out, numpy.int16)
-    # Convert to float64 (which is the format used by pyrubberband)
-    # audio_data = audio_data.astype(numpy.float64)
-    # # Normalize the data to the range of float64 audio
-    # audio_data /= numpy.iinfo(numpy.int16).max
-
-    return out # Returns bytes
-
-def stretch_audio_clip(audioFileToStretch, speedFactor, num):
-    virtualTempAudioFile = io.BytesIO()
-    # Write the raw string to virtualtempaudiofile
-    audioObj: ndarray
-    audioObj, sampleRate = soundfile.read(audioFileToStretch)  # audioObj is a numpy array
-    
-    # Stretch the audio using user specified method
-    if config.local_audio_stretch_method == 'ffmpeg':
-        stretched_audio = stretch_with_ffmpeg(audioFileToStretch, speedFactor)
-        virtualTempAudioFile.write(stretched_audio)
-        if config.debug_mode:
-            # For debugging, save the stretched audio file using soundfile
-            debug_file_path = os.path.join(workingFolder, f'{num}_stretched_ffmpeg.wav')
-            with open(debug_file_path, 'wb') as f:
-                f.write(stretched_audio)
-    elif config.local_audio_stretch_method == 'rubberband':
-        stretched_audio = stretch_with_rubberband(audioObj, sampleRate, speedFactor)
-        #soundfile.write(f'{workingFolder}\\temp_stretched.wav', streched_audio, sampleRate)
-        soundfile.write(virtualTempAudioFile, stretched_audio, sampleRate, format='wav')
-        if config.debug_mode:
-            soundfile.write(os.path.join(workingFolder, f'{num}_stretched.wav'), stretched_audio, sampleRate) # For debugging, saves the stretched audio files
-    #return AudioSegment.from_file(f'{workingFolder}\\temp_stretched.wav', format="wav")
-    return AudioSegment.from_file(virtualTempAudioFile, format="wav")
-
-
-def build_audio(subsDict:SubtitleDict, langDict:dict[LangDictKeys, Any], totalAudioLength:int, twoPassVoiceSynth:bool=False):
-    virtualTrimmedFileDict = {}
-    # First trim silence off the audio files
+# Makes sure every line has a synthesized audio file before handing them off to be processed
+def check_synthesized_files(subsDict:SubtitleDict) -> None:
     for key, value in subsDict.items():
-        filePathTrimmed = os.path.join(workingFolder,  str(key)) + "_trimmed.wav"
-        subsDict[key][SubsDictKeys.TTS_FilePath_Trimmed] = filePathTrimmed
-
-        # Trim the clip and re-write file
-        try:
-            rawClip = AudioSegment.from_file(value[SubsDictKeys.TTS_FilePath], format="mp3")
-        except KeyError:
+        if SubsDictKeys.TTS_FilePath not in value:
             print("\nERROR: An expected file was not found. This is likely because the TTS service failed to synthesize the audio. Refer to any error messages above.")
             sys.exit()
-        except FileNotFoundError:
+        if not os.path.isfile(str(value[SubsDictKeys.TTS_FilePath])):
             if value[SubsDictKeys.TTS_FilePath] == "Failed":
                 print("\nProgram failed because some audio was not synthesized. Refer to any error messages above.")
             else:
                 print("\nERROR: An expected file was not found. This is likely because the TTS service failed to synthesize the audio. Refer to any error messages above.")
             sys.exit()
-        trimmedClip = trim_clip(rawClip)
-        if config.debug_mode:
-            trimmedClip.export(filePathTrimmed, format="wav")
-
-        # Create virtual file in dictionary with audio to be read later
-        tempTrimmedFile = io.BytesIO()
-        trimmedClip.export(tempTrimmedFile, format="wav")
-        virtualTrimmedFileDict[key] = tempTrimmedFile
-        keyIndex = list(subsDict.keys()).index(key)
-        print(f" Trimmed Audio: {keyIndex+1} of {len(subsDict)}", end="\r")
-    print("\n")
 
-    # Calculates speed factor if necessary. Azure doesn't need this, so skip it
-    if not cloudConfig.tts_service == TTSService.AZURE or config.force_always_stretch == True:
-        # Calculate speed factors for each clip, aka how much to stretch the audio
-        for key, value in subsDict.items():
-            #subsDict = get_speed_factor(subsDict, value[SubsDictKeys.TTS_FilePath_Trimmed], value[SubsDictKeys.duration_ms], num=key)
-            subsDict = get_speed_factor(subsDict, virtualTrimmedFileDict[key], value[SubsDictKeys.duration_ms], num=key)
-            keyIndex = list(subsDict.keys()).index(key)
-            print(f" Calculated Speed Factor: {keyIndex+1} of {len(subsDict)}", end="\r")
-        print("\n")
-        
-    # Decide if doing two pass voice synth
-    servicesToUseTwoPass = [TTSService.GOOGLE]
-    servicesSupportingExactDuration = [TTSService.AZURE]
-    if cloudConfig.tts_service not in servicesToUseTwoPass:
-        twoPassVoiceSynth = False
-    if cloudConfig.tts_service in servicesSupportingExactDuration:
-        twoPassVoiceSynth = False
+# Checks each line's file as its key comes in, for when lines are still being synthesized while the earlier ones are processed
+def check_each_synthesized_file(subsDict:SubtitleDict, keys:Iterable[int]) -> Iterator[int]:
+    for key in keys:
+        check_synthesized_files({key: subsDict[key]})
+        yield key
 
-    # If two pass voice synth is enabled, have API re-synthesize the clips at the new speed
-    # Azure allows direct specification of audio duration, so no need to re-synthesize
-    if twoPassVoiceSynth == True:
-        if cloudConfig.batch_tts_synthesize == True and cloudConfig.tts_service == TTSService.AZURE:
-            subsDict = TTS.synthesize_dictionary_batch(subsDict, langDict, skipSynthesize=config.skip_synthesize, secondPass=True)
-        else:
-            subsDict = TTS.synthesize_dictionary(subsDict, langDict, skipSynthesize=config.skip_synthesize, secondPass=True)
-            
-        for key, value in subsDict.items():
-            # Trim the clip and re-write file
-            rawClip = AudioSegment.from_file(value[SubsDictKeys.TTS_FilePath], format="mp3")
-            trimmedClip = trim_clip(rawClip)
-            if config.debug_mode:
-                # Remove '.wav' from the end of the file path
-                secondPassTrimmedFile = str(value[SubsDictKeys.TTS_FilePath_Trimmed])[:-4] + "_p2_trimmed.wav"
-                trimmedClip.export(secondPassTrimmedFile, format="wav")
-            trimmedClip.export(virtualTrimmedFileDict[key], format="wav")
-            keyIndex = list(subsDict.keys()).index(key)
-            print(f" Trimmed Audio (2nd Pass): {keyIndex+1} of {len(subsDict)}", end="\r")
-        print("\n")
+# Print warning if audio clip is longer than expected and would overlap next clip
+def warn_if_clip_too_long(subsDict:SubtitleDict, key:int, currentClipTrueDuration:float, langDict:dict[LangDictKeys, Any], totalAudioLength:int) -> None:
+    value = subsDict[key]
+    currentClipExpectedDuration = int(value[SubsDictKeys.duration_ms])
+    difference = str(round(currentClipTrueDuration - currentClipExpectedDuration))
+    if key < len(subsDict) and (currentClipTrueDuration + int(value[SubsDictKeys.start_ms]) > int(subsDict[key+1][SubsDictKeys.start_ms])):
+        print(f"WARNING: Audio clip {str(key)} for language {langDict[LangDictKeys.languageCode]} is {difference}ms longer than expected and may overlap the next clip. Inspect the audio file after completion.")
+    elif key == len(subsDict) and (currentClipTrueDuration + int(value[SubsDictKeys.start_ms]) > totalAudioLength):
+        print(f"WARNING: Audio clip {str(key)} for language {langDict[LangDictKeys.languageCode]} is {difference}ms longer than expected and may cut off at the end of the file. Inspect the audio file after completion.")
 
-        if config.force_stretch_with_twopass == True:
-            for key, value in subsDict.items():
-                subsDict = get_speed_factor(subsDict, virtualTrimmedFileDict[key], value[SubsDictKeys.duration_ms], num=key)
-                keyIndex = list(subsDict.keys()).index(key)
-                print(f" Calculated Speed Factor (2nd Pass): {keyIndex+1} of {len(subsDict)}", end="\r")
-            print("\n")
+# Prints the cache stats and deletes old clips if the cache got too big
+def finish_clip_cache(cacheStats:CacheStats) -> None:
+    if not config.clip_cache:
+        return
+    print(cacheStats.summary("Clip cache"))
+    DiskCache(CLIP_CACHE_FOLDER, config.clip_cache_max_size_mb).enforce_size_limit()
 
-    # Create canvas to overlay audio onto
-    canvas = create_canvas(totalAudioLength)
+def make_clip_jobs(subsDict:SubtitleDict, workingFolder:str, stretch:bool, measureOnly:bool=False, saveTrimmed:bool=False, debugSuffix:str="") -> list[clip_processing.ClipJob]:
+    return list(iter_clip_jobs(subsDict, workingFolder, subsDict, stretch, measureOnly, saveTrimmed, debugSuffix))
 
-    # Stretch audio and insert into canvas
-    for key, value in subsDict.items():
-        if ((not twoPassVoiceSynth or config.force_stretch_with_twopass == True) and (cloudConfig.tts_service not in servicesSupportingExactDuration)) or config.force_always_stretch == True: # Don't stretch if azure is used unless forced
-            #stretchedClip = stretch_audio_clip(value[SubsDictKeys.TTS_FilePath_Trimmed], speedFactor=subsDict[key][SubsDictKeys.speed_factor], num=key)
-            stretchedClip = stretch_audio_clip(virtualTrimmedFileDict[key], speedFactor=subsDict[key][SubsDictKeys.speed_factor], num=key)
-        else:
-            #stretchedClip = AudioSegment.from_file(value[SubsDictKeys.TTS_FilePath_Trimmed], format="wav")
-            stretchedClip = AudioSegment.from_file(virtualTrimmedFileDict[key], format="wav")
-            virtualTrimmedFileDict[key].seek(0) # Not 100% sure if this is necessary but it was in the other place it is used
-
-        canvas = insert_audio(canvas, stretchedClip, value[SubsDictKeys.start_ms])
-        
-        # Print warning if audio clip is longer than expected and would overlap next clip
-        currentClipExpectedDuration = int(value[SubsDictKeys.duration_ms])
-        currentClipTrueDuration = stretchedClip.duration_seconds * 1000
-        difference = str(round(currentClipTrueDuration - currentClipExpectedDuration))
-        if key < len(subsDict) and (currentClipTrueDuration + int(value[SubsDictKeys.start_ms]) > int(subsDict[key+1][SubsDictKeys.start_ms])):
-            print(f"WARNING: Audio clip {str(key)} for language {langDict[LangDictKeys.languageCode]} is {difference}ms longer than expected and may overlap the next clip. Inspect the audio file after completion.")
-        elif key == len(subsDict) and (currentClipTrueDuration + int(value[SubsDictKeys.start_ms]) > totalAudioLength):
-            print(f"WARNING: Audio clip {str(key)} for language {langDict[LangDictKeys.languageCode]} is {difference}ms longer than expected and may cut off at the end of the file. Inspect the audio file after completion.")
-            
-            
-        keyIndex = list(subsDict.keys()).index(key)
-        print(f" Final Audio Processed: {keyIndex+1} of {len(subsDict)}", end="\r")
-    print("\n")
+# Creates the jobs one at a time as the keys come in, so jobs can be started for lines that are ready before the rest are
+# Lines in alwaysStretchKeys are stretched even if stretch is False
+def iter_clip_jobs(subsDict:SubtitleDict, workingFolder:str, keys:Iterable[int], stretch:bool, measureOnly:bool=False, saveTrimmed:bool=False, debugSuffix:str="", alwaysStretchKeys:Container[int]=()) -> Iterator[clip_processing.ClipJob]:
+    for key in keys:
+        value = subsDict[key]
+        debugFileStem = os.path.join(workingFolder, str(key)) + debugSuffix if config.debug_mode else None
+        yield clip_processing.ClipJob(
+            key=key,
+            filePath=str(value[SubsDictKeys.TTS_FilePath]),
+            desiredDurationMs=float(value[SubsDictKeys.duration_ms]),
+            targetFrameRate=config.canvas_sample_rate,
+            stretch=stretch or key in alwaysStretchKeys,
+            stretchMethod=config.local_audio_stretch_method,
+            silenceThresholdDb=config.silence_trim_threshold_db,
+            silencePaddingMs=config.silence_trim_padding_ms,
+            measureOnly=measureOnly,
+            trimmedFilePath=str(value[SubsDictKeys.TTS_FilePath_Trimmed]) if saveTrimmed else None,
+            cacheFolder=CLIP_CACHE_FOLDER if config.clip_cache else None,
+            debugFileStem=debugFileStem,
+        )
 
+# Returns the output file path and the format string to give to the exporter
+def get_output_file_info(langDict:dict[LangDictKeys, Any]) -> tuple[str, str]:
     # Use video file name to use in the name of the output file. Add language name and language code
     lang = langcodes.get(langDict[LangDictKeys.languageCode])
     langName = langcodes.get(langDict[LangDictKeys.languageCode]).get(lang.to_alpha3()).display_name()
@@ -243,13 +97,185 @@ def build_audio(subsDict:SubtitleDict, langDict:dict[LangDictKeys, Any], totalAu
         outputFileName += config.output_format
         formatString = config.output_format
 
-    canvas = canvas.set_channels(2) # Change from mono to stereo
+    return outputFileName, formatString
+
+# Only trims and measures the clips locally, then has a single ffmpeg filter graph do the stretching, positioning, mixing and encoding
+def render_audio_with_filtergraph(subsDict:SubtitleDict, langDict:dict[LangDictKeys, Any], totalAudioLength:int, outputFileName:str, formatString:str, workers:int, stretchClips:bool, storeSpeedFactors:bool, cacheStats:CacheStats, readyKeys:Iterable[int], debugSuffix:str="", alwaysStretchKeys:Container[int]=()) -> None:
+    filterGraphClips:list[audio_mixer.FilterGraphClip] = []
+    clipJobs = iter_clip_jobs(subsDict, langDict[LangDictKeys.workingFolder], readyKeys, stretch=False, measureOnly=True, saveTrimmed=True, debugSuffix=debugSuffix)
+    for index, result in enumerate(clip_processing.iter_processed_clips(clipJobs, workers, cacheStats)):
+        key = result.key
+        stretchClip = stretchClips or key in alwaysStretchKeys
+        if storeSpeedFactors:
+            subsDict[key][SubsDictKeys.speed_factor] = result.speedFactor
+        filterGraphClips.append(audio_mixer.FilterGraphClip(
+            filePath=str(subsDict[key][SubsDictKeys.TTS_FilePath_Trimmed]),
+            startMs=int(subsDict[key][SubsDictKeys.start_ms]),
+            speedFactor=result.speedFactor if stretchClip else None,
+        ))
+        finalDuration = result.trimmedDurationMs / result.speedFactor if stretchClip else result.trimmedDurationMs
+        warn_if_clip_too_long(subsDict, key, finalDuration, langDict, totalAudioLength)
+        print(f" Trimmed Audio: {index+1} of {len(subsDict)}", end="\r")
+    print("\n")
+    finish_clip_cache(cacheStats)
+
+    print("\nMixing and exporting audio file with ffmpeg...")
+    try:
+        audio_mixer.render_with_filtergraph(filterGraphClips, totalAudioLength, outputFileName, formatString, frameRate=config.canvas_sample_rate, channels=2, bitrate="192k", maxInputs=config.filtergraph_max_inputs, tempFolder=langDict[LangDictKeys.workingFolder])
+    except Exception as ex:
+        print(f"\nThere was an issue exporting the audio with ffmpeg: {ex}")
+        input("Press Enter to exit...")
+
+# Exports the track kept by the incremental render store, after patching in the lines that changed
+def export_incremental_render(incrementalStore:IncrementalRenderStore, subsDict:SubtitleDict, langDict:dict[LangDictKeys, Any]) -> None:
+    outputFileName, formatString = get_output_file_info(langDict)
+    print("\nMixing changed lines into previous render..." if not incrementalStore.fullRender else "\nMixing audio...")
+    incrementalStore.update_mix(subsDict)
+    try:
+        print("\nExporting audio file...")
+        incrementalStore.export(outputFileName, formatString)
+    except:
+        outputFileName = outputFileName + ".bak"
+        incrementalStore.export(outputFileName, formatString)
+        print("\nThere was an issue exporting the audio, it might be a permission error. The file was saved as a backup with the extension .bak")
+        print("Try removing the .bak extension then listen to the file to see if it worked.\n")
+        input("Press Enter to exit...")
+
+# If an incremental render store is given, only the lines it found as changed are processed, and the rest of the track is reused from the last run
+# If synthesizedKeys is given, the lines are still being synthesized, and it gives the key of each line in order once its audio is ready (see TTS.synthesize_all_streaming)
+def build_audio(subsDict:SubtitleDict, langDict:dict[LangDictKeys, Any], totalAudioLength:int, twoPassVoiceSynth:bool=False, incrementalStore:Optional[IncrementalRenderStore]=None, synthesizedKeys:Optional[Iterator[int]]=None):
+    workers = clip_processing.resolve_worker_count(config.clip_processing_workers)
+    cacheStats = CacheStats()
+
+    # Lines that need to be trimmed, stretched and mixed this run. The full dictionary is still used for checking overlaps with neighboring lines
+    renderDict = subsDict if incrementalStore is None else {key: subsDict[key] for key in incrementalStore.changedKeys}
+
+    for key in renderDict:
+        renderDict[key][SubsDictKeys.TTS_FilePath_Trimmed] = os.path.join(langDict[LangDictKeys.workingFolder], str(key)) + "_trimmed.wav"
+    if synthesizedKeys is None:
+        check_synthesized_files(renderDict)
+        readyKeys:Iterable[int] = list(renderDict)
+    else:
+        readyKeys = check_each_synthesized_file(renderDict, synthesizedKeys)
+
+    # Decide if doing two pass voice synth
+    servicesToUseTwoPass = [TTSService.GOOGLE]
+    servicesSupportingExactDuration = [TTSService.AZURE]
+    if cloudConfig.tts_service not in servicesToUseTwoPass:
+        twoPassVoiceSynth = False
+    if cloudConfig.tts_service in servicesSupportingExactDuration:
+        twoPassVoiceSynth = False
+
+    # Speed factors are only needed if stretching locally or doing a second pass. Azure doesn't need this, so skip it
+    storeSpeedFactors = not cloudConfig.tts_service == TTSService.AZURE or config.force_always_stretch == True
+    # Don't stretch if azure is used unless forced
+    stretchClips = ((not twoPassVoiceSynth or config.force_stretch_with_twopass == True) and (cloudConfig.tts_service not in servicesSupportingExactDuration)) or config.force_always_stretch == True
+    # With two pass synth, the first pass speed factors are kept unless the second pass clips get stretched too
+    storeFinalSpeedFactors = storeSpeedFactors and (not twoPassVoiceSynth or stretchClips)
+    # The speaking rate is learned from the first pass clips, unless they're from a previous run. Without a second pass, the final speed factors are measured from those
+    learnSpeakingRate = config.learn_speaking_rate and cloudConfig.tts_service == TTSService.GOOGLE and not config.skip_synthesize
+    learnAfterRender = learnSpeakingRate and not twoPassVoiceSynth and storeFinalSpeedFactors
+
+    # If two pass voice synth is enabled, have API re-synthesize the clips at the new speed
+    # Azure allows direct specification of audio duration, so no need to re-synthesize
+    locallyStretchedKeys:set[int] = set() # Lines that keep their first pass audio, and get stretched locally instead
+    if twoPassVoiceSynth == True:
+        # Every first pass clip is needed before the second pass can start, so wait for any still being synthesized
+        for _ in readyKeys:
+            pass
+        readyKeys = list(renderDict)
+        # The first pass clips are only needed to calculate the speed factors
+        keys, _, speedFactors = clip_processing.measure_speed_factors(make_clip_jobs(renderDict, langDict[LangDictKeys.workingFolder], stretch=False, measureOnly=True), workers, cacheStats)
+        for key, speedFactor in zip(keys, speedFactors.tolist()):
+            renderDict[key][SubsDictKeys.speed_factor] = speedFactor
+        if learnSpeakingRate:
+            speaking_rate.learn_from_first_pass(renderDict, langDict)
+
+        # Lines that are already close to the right length only need a small stretch, which sounds nearly the same as synthesizing them again
+        secondPassDict = {key: value for key, value in renderDict.items() if abs(cast(float, value[SubsDictKeys.speed_factor]) - 1) > config.two_pass_tolerance}
+        locallyStretchedKeys = set(renderDict) - set(secondPassDict)
+        if locallyStretchedKeys:
+            print(f"{len(locallyStretchedKeys)} of {len(renderDict)} lines are within {config.two_pass_tolerance:.0%} of the right length, so they will be stretched instead of synthesized again.")
+
+        # If the first pass already used a different speaking rate, the second pass rate is relative to it
+        for value in secondPassDict.values():
+            value[SubsDictKeys.speed_factor] = cast(float, value[SubsDictKeys.speed_factor]) * cast(float, value.get(SubsDictKeys.first_pass_speaking_rate, 1.0))
+
+        # The synthesize functions update the entries in place, which are shared with the full dictionary
+        if secondPassDict:
+            TTS.synthesize_all(secondPassDict, langDict, skipSynthesize=config.skip_synthesize, secondPass=True)
+            check_synthesized_files(secondPassDict)
+        debugSuffix = "_p2"
+    else:
+        debugSuffix = ""
+
+    if incrementalStore is not None:
+        # Each changed line's final clip is saved, then only the parts of the track they cover are re-mixed
+        for index, result in enumerate(clip_processing.iter_processed_clips(iter_clip_jobs(renderDict, langDict[LangDictKeys.workingFolder], readyKeys, stretch=stretchClips, debugSuffix=debugSuffix, alwaysStretchKeys=locallyStretchedKeys), workers, cacheStats)):
+            if storeFinalSpeedFactors:
+                subsDict[result.key][SubsDictKeys.speed_factor] = result.speedFactor
+            incrementalStore.save_clip(result.key, result.clip) # type: ignore[arg-type]
+            warn_if_clip_too_long(subsDict, result.key, result.duration_ms, langDict, totalAudioLength)
+            print(f" Final Audio Processed: {index+1} of {len(renderDict)}", end="\r")
+        print("\n")
+        if learnAfterRender:
+            speaking_rate.learn_from_first_pass(renderDict, langDict)
+        finish_clip_cache(cacheStats)
+        export_incremental_render(incrementalStore, subsDict, langDict)
+        return
+
+    outputFileName, formatString = get_output_file_info(langDict)
+
+    if config.render_mode == AudioRenderMode.FILTERGRAPH:
+        render_audio_with_filtergraph(subsDict, langDict, totalAudioLength, outputFileName, formatString, workers, stretchClips, storeFinalSpeedFactors, cacheStats, readyKeys, debugSuffix, locallyStretchedKeys)
+        if learnAfterRender:
+            speaking_rate.learn_from_first_pass(renderDict, langDict)
+        return
+    clipJobs = iter_clip_jobs(subsDict, langDict[LangDictKeys.workingFolder], readyKeys, stretch=stretchClips, debugSuffix=debugSuffix, alwaysStretchKeys=locallyStretchedKeys)
+
+    # Create canvas to overlay audio onto. In streaming mode, the audio is mixed and encoded a window at a time instead
+    if config.render_mode == AudioRenderMode.STREAMING:
+        # Check the output file can be written before starting, because streamed audio can't be re-exported afterwards
+        try:
+            open(outputFileName, 'wb').close()
+        except OSError:
+            outputFileName = outputFileName + ".bak"
+            print("\nThere was an issue creating the output file, it might be a permission error. The file will be saved as a backup with the extension .bak")
+        encoder = audio_mixer.open_ffmpeg_encoder(outputFileName, formatString, frameRate=config.canvas_sample_rate, channels=2, bitrate="192k")
+        canvas = audio_mixer.StreamingMixer(totalAudioLength, encoder, frameRate=config.canvas_sample_rate, windowSeconds=config.streaming_window_seconds)
+    else:
+        canvas = create_canvas(totalAudioLength)
+
+    # Trim, stretch and insert audio into canvas. Clips are processed in parallel but come back in subtitle order
+    for index, result in enumerate(clip_processing.iter_processed_clips(clipJobs, workers, cacheStats)):
+        key = result.key
+        value = subsDict[key]
+        if storeFinalSpeedFactors:
+            subsDict[key][SubsDictKeys.speed_factor] = result.speedFactor
+
+        canvas.add_clip(result.clip, value[SubsDictKeys.start_ms]) # type: ignore[arg-type]
+
+        warn_if_clip_too_long(subsDict, key, result.duration_ms, langDict, totalAudioLength)
+
+        print(f" Final Audio Processed: {index+1} of {len(subsDict)}", end="\r")
+    print("\n")
+    if learnAfterRender:
+        speaking_rate.learn_from_first_pass(renderDict, langDict)
+    finish_clip_cache(cacheStats)
+
+    if isinstance(canvas, audio_mixer.StreamingMixer):
+        print("\nFinishing audio export...")
+        canvas.finish()
+        return
+
+    finalAudio = canvas.to_segment(channels=2) # Clip the mixed samples and change from mono to stereo
+    del canvas
     try:
         print("\nExporting audio file...")
-        canvas.export(outputFileName, format=formatString, bitrate="192k")
+        finalAudio.export(outputFileName, format=formatString, bitrate="192k")
     except:
         outputFileName = outputFileName + ".bak"
-        canvas.export(outputFileName, format=formatString, bitrate="192k")
+        finalAudio.export(outputFileName, format=formatString, bitrate="192k")
         print("\nThere was an issue exporting the audio, it might be a permission error. The file was saved as a backup with the extension .bak")
         print("Try removing the .bak extension then listen to the file to see if it worked.\n")
         input("Press Enter to exit...")
@@ -0,0 +1,72 @@
+import io
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy
+import soundfile
+from numpy import ndarray
+
+import Scripts.audio_dsp as audio_dsp
+
+# A single decoded audio clip, kept as mono float32 samples along with its sample rate
+# Clips are decoded from the TTS file once, and every step after that (trimming, stretching, resampling, mixing) works on the samples directly
+
+@dataclass
+class AudioClip:
+    samples: ndarray
+    sampleRate: int
+
+    def __post_init__(self):
+        self.samples = numpy.asarray(self.samples, dtype=numpy.float32)
+        # Mix down to mono if there are multiple channels
+        if self.samples.ndim > 1:
+            self.samples = self.samples.mean(axis=1, dtype=numpy.float32)
+
+    @classmethod
+    def from_file(cls, filePath:str) -> 'AudioClip':
+        try:
+            # libsndfile can decode wav and mp3 directly into float32, without starting ffmpeg
+            samples, sampleRate = soundfile.read(filePath, dtype='float32', always_2d=False)
+        except RuntimeError: # soundfile.LibsndfileError is a RuntimeError
+            # Older libsndfile versions can't read mp3, so fall back to pydub which uses ffmpeg
+            from pydub import AudioSegment
+            import Scripts.audio_mixer as audio_mixer
+            segment = AudioSegment.from_file(filePath)
+            samples, sampleRate = audio_mixer.segment_to_samples(segment), segment.frame_rate
+        return cls(samples, sampleRate)
+
+    # Reads the duration from the file header, without decoding any audio
+    @staticmethod
+    def read_duration_ms(filePath:str) -> float:
+        info = soundfile.info(filePath)
+        if info.samplerate == 0:
+            return 0
+        return info.frames * 1000 / info.samplerate
+
+    @property
+    def duration_ms(self) -> float:
+        if self.sampleRate == 0:
+            return 0
+        return len(self.samples) * 1000 / self.sampleRate
+
+    def trimmed(self, thresholdDb:float=-50.0, paddingMs:int=0) -> 'AudioClip':
+        return AudioClip(audio_dsp.trim_silence(self.samples, self.sampleRate, thresholdDb, paddingMs), self.sampleRate)
+
+    def resampled(self, targetRate:int) -> 'AudioClip':
+        if targetRate == self.sampleRate:
+            return self
+        return AudioClip(audio_dsp.resample(self.samples, self.sampleRate, targetRate), targetRate)
+
+    def save(self, filePath:str, subtype:Optional[str]=None) -> None:
+        soundfile.write(filePath, self.samples, self.sampleRate, subtype=subtype)
+
+    # Serializes the clip as a 32 bit float wav file, so it can be stored without losing anything
+    def to_bytes(self) -> bytes:
+        buffer = io.BytesIO()
+        soundfile.write(buffer, self.samples, self.sampleRate, format='WAV', subtype='FLOAT')
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data:bytes) -> 'AudioClip':
+        samples, sampleRate = soundfile.read(io.BytesIO(data), dtype='float32', always_2d=False)
+        return cls(samples, sampleRate)
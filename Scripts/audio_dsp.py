@@ -0,0 +1,142 @@
+import math
+import functools
+
+import numpy
+from numpy import ndarray
+
+# Signal processing helpers that work directly on numpy sample arrays
+# This only depends on numpy and doesn't read any config, so the Tools scripts can import it too
+
+# ======================================== Silence Trimming ================================================
+
+# Returns the RMS of each consecutive frame of the samples. The last frame may be shorter than the others
+def frame_rms(samples:ndarray, frameLength:int) -> ndarray:
+    if len(samples) == 0:
+        return numpy.zeros(0, dtype=numpy.float64)
+    squared = numpy.square(samples, dtype=numpy.float64)
+    frameStarts = numpy.arange(0, len(samples), frameLength)
+    frameSums = numpy.add.reduceat(squared, frameStarts)
+    frameLengths = numpy.diff(numpy.append(frameStarts, len(samples)))
+    return numpy.sqrt(frameSums / frameLengths)
+
+# Finds the first and last non-silent sample, using the same approach as pydub's detect_leading_silence
+# Frames are measured from the start for the leading silence and from the end for the trailing silence, all in one pass each
+# Samples should be floats between -1.0 and 1.0, so the threshold is in dBFS
+# Returns (start, end) sample indexes, where end is exclusive. If everything is silent, start and end will be equal
+def find_trim_bounds(samples:ndarray, sampleRate:int, thresholdDb:float=-50.0, paddingMs:int=0, chunkMs:int=10) -> tuple[int, int]:
+    numSamples = len(samples)
+    if numSamples == 0:
+        return 0, 0
+    chunkSize = max(1, int(round(sampleRate * chunkMs / 1000)))
+    thresholdAmplitude = 10 ** (thresholdDb / 20)
+
+    leadingLoud = numpy.flatnonzero(frame_rms(samples, chunkSize) >= thresholdAmplitude)
+    if len(leadingLoud) == 0:
+        return numSamples, numSamples
+    trailingLoud = numpy.flatnonzero(frame_rms(samples[::-1], chunkSize) >= thresholdAmplitude)
+
+    start = int(leadingLoud[0]) * chunkSize
+    end = numSamples - int(trailingLoud[0]) * chunkSize
+
+    paddingSamples = int(round(sampleRate * paddingMs / 1000))
+    start = max(0, start - paddingSamples)
+    end = min(numSamples, end + paddingSamples)
+    if end < start:
+        end = start
+    return start, end
+
+# Returns the samples with leading and trailing silence removed. This is a view of the original array, not a copy
+def trim_silence(samples:ndarray, sampleRate:int, thresholdDb:float=-50.0, paddingMs:int=0, chunkMs:int=10) -> ndarray:
+    start, end = find_trim_bounds(samples, sampleRate, thresholdDb, paddingMs, chunkMs)
+    return samples[start:end]
+
+# ======================================== Time Stretching ================================================
+
+# Time stretches the samples using WSOLA (Waveform Similarity Overlap-Add), without changing the pitch
+# Speed factor works the same as everywhere else in the program: 2.0 means twice as fast, so the result is half as long
+# Each output frame is taken from around where it "should" come from in the input, shifted slightly to whichever position
+# lines up best with the previous frame. That keeps the waveform continuous, which avoids the phasing sound of plain overlap-add
+def wsola_stretch(samples:ndarray, sampleRate:int, speedFactor:float, frameMs:float=20, toleranceMs:float=5) -> ndarray:
+    if speedFactor <= 0:
+        raise ValueError(f"ERROR: Speed factor must be above zero. It was: {speedFactor}")
+    samples = numpy.asarray(samples, dtype=numpy.float32)
+    outputLength = int(round(len(samples) / speedFactor))
+    if len(samples) == 0 or outputLength == 0:
+        return numpy.zeros(outputLength, dtype=numpy.float32)
+
+    frameLength = max(4, int(sampleRate * frameMs / 1000)) // 2 * 2
+    synthesisHop = frameLength // 2
+    analysisHop = synthesisHop * speedFactor
+    tolerance = max(1, int(sampleRate * toleranceMs / 1000))
+    window = numpy.hanning(frameLength + 1)[:frameLength].astype(numpy.float32) # Periodic hann, sums to 1 at 50% overlap
+
+    numFrames = int(numpy.ceil(max(outputLength - frameLength, 0) / synthesisHop)) + 1
+    # Pad so every candidate frame, including the shifted ones, stays inside the array
+    padding = frameLength + tolerance
+    padded = numpy.concatenate([numpy.zeros(padding, dtype=numpy.float32), samples, numpy.zeros(padding + frameLength + int(numpy.ceil(analysisHop)) * 2, dtype=numpy.float32)])
+
+    output = numpy.zeros((numFrames - 1) * synthesisHop + frameLength, dtype=numpy.float32)
+    windowSum = numpy.zeros_like(output)
+
+    previousPosition = padding # Position in the padded input of the previously used frame
+    for frameNum in range(numFrames):
+        nominalPosition = padding + int(round(frameNum * analysisHop))
+        if frameNum == 0:
+            position = nominalPosition
+        else:
+            # The natural continuation of the previous frame is what the next frame should look similar to
+            template = padded[previousPosition + synthesisHop : previousPosition + synthesisHop + frameLength]
+            searchRegion = padded[nominalPosition - tolerance : nominalPosition + tolerance + frameLength]
+            correlation = numpy.correlate(searchRegion, template, mode='valid')
+            position = nominalPosition - tolerance + int(numpy.argmax(correlation))
+
+        outStart = frameNum * synthesisHop
+        output[outStart:outStart + frameLength] += padded[position:position + frameLength] * window
+        windowSum[outStart:outStart + frameLength] += window
+        previousPosition = position
+
+    # Undo the window gain at the edges where frames don't fully overlap
+    numpy.divide(output, windowSum, out=output, where=windowSum > 1e-3)
+    return output[:outputLength]
+
+# ======================================== Resampling ================================================
+
+# Builds the polyphase filter bank for resampling by a ratio of up / down. Cached, since a run only ever uses a few pairs of sample rates
+# The low pass filter is a Kaiser windowed sinc at whichever of the two Nyquist frequencies is lower, to avoid aliasing in both directions
+# Returns the bank with one row of taps per phase (reversed, so they can be multiplied directly with the input samples), and the filter delay
+@functools.lru_cache(maxsize=16)
+def polyphase_filter_bank(up:int, down:int, halfLength:int=16, kaiserBeta:float=8.6) -> tuple[ndarray, int]:
+    cutoff = 1.0 / max(up, down)
+    numTaps = 2 * halfLength * max(up, down) + 1
+    taps = cutoff * numpy.sinc(cutoff * (numpy.arange(numTaps) - (numTaps - 1) / 2)) * numpy.kaiser(numTaps, kaiserBeta) * up
+    phaseLength = -(-numTaps // up)
+    taps = numpy.concatenate([taps, numpy.zeros(phaseLength * up - numTaps)])
+    bank = numpy.ascontiguousarray(taps.reshape(phaseLength, up).T[:, ::-1], dtype=numpy.float32)
+    bank.setflags(write=False) # Shared between calls, so make sure nothing changes it
+    return bank, (numTaps - 1) // 2
+
+# Changes the sample rate using a polyphase windowed sinc filter
+# Only the output samples are calculated, so the input is never actually upsampled. Output is processed in blocks to limit memory use
+def resample(samples:ndarray, sourceRate:int, targetRate:int, blockSize:int=65536) -> ndarray:
+    samples = numpy.asarray(samples, dtype=numpy.float32)
+    if sourceRate == targetRate or len(samples) == 0:
+        return samples
+    divisor = math.gcd(sourceRate, targetRate)
+    up, down = targetRate // divisor, sourceRate // divisor
+    bank, delay = polyphase_filter_bank(up, down)
+    phaseLength = bank.shape[1]
+
+    outputLength = int(round(len(samples) * up / down))
+    # Pad so the windows for the first and last output samples stay inside the array
+    endPadding = delay // up + 2
+    padded = numpy.concatenate([numpy.zeros(phaseLength - 1, dtype=numpy.float32), samples, numpy.zeros(endPadding, dtype=numpy.float32)])
+    windows = numpy.lib.stride_tricks.sliding_window_view(padded, phaseLength)
+
+    output = numpy.empty(outputLength, dtype=numpy.float32)
+    for blockStart in range(0, outputLength, blockSize):
+        # Position of each output sample in the (virtual) upsampled signal, shifted by the filter delay to keep it lined up with the input
+        upsampledPositions = numpy.arange(blockStart, min(blockStart + blockSize, outputLength), dtype=numpy.int64) * down + delay
+        phases = upsampledPositions % up
+        inputPositions = upsampledPositions // up # Index of the newest input sample that contributes, which is also its window's start in padded
+        output[blockStart:blockStart + len(phases)] = numpy.einsum('ij,ij->i', bank[phases], windows[inputPositions])
+    return output
@@ -0,0 +1,242 @@
+import os
+import math
+import subprocess
+from dataclasses import dataclass
+from typing import Optional
+import numpy
+from numpy import ndarray
+from pydub import AudioSegment
+
+from Scripts.audio_clip import AudioClip
+
+# Mixes audio clips into a single preallocated float32 sample buffer, instead of using pydub's overlay
+# pydub's overlay() copies the entire canvas every time a clip is added, so for long videos with many lines
+# that ends up copying the full length audio thousands of times. Here each clip is just added in place at its offset.
+
+def ms_to_samples(milliseconds:int|float|str, frameRate:int) -> int:
+    return int(round(float(milliseconds) * frameRate / 1000))
+
+# Converts a pydub AudioSegment into a mono float32 numpy array in the range -1.0 to 1.0
+def segment_to_samples(segment:AudioSegment, frameRate:int|None=None) -> ndarray:
+    # Match what pydub's overlay would have done to the clip before mixing
+    if segment.channels != 1:
+        segment = segment.set_channels(1)
+    if frameRate is not None and segment.frame_rate != frameRate:
+        segment = segment.set_frame_rate(frameRate)
+
+    samples = numpy.array(segment.get_array_of_samples(), dtype=numpy.float32)
+    # Scale based on sample width, so 16 bit audio is divided by 32768, etc
+    samples /= float(1 << (8 * segment.sample_width - 1))
+    return samples
+
+# Converts float32 samples back into 16 bit PCM bytes, clipping anything outside the valid range
+def samples_to_pcm16(samples:ndarray) -> bytes:
+    clipped = numpy.clip(samples, -1.0, 32767 / 32768)
+    return (clipped * 32768).astype('<i2').tobytes()
+
+def samples_to_segment(samples:ndarray, frameRate:int, channels:int=1) -> AudioSegment:
+    if channels > 1:
+        # Duplicate the mono channel into interleaved frames
+        samples = numpy.repeat(samples, channels)
+    return AudioSegment(data=samples_to_pcm16(samples), sample_width=2, frame_rate=frameRate, channels=channels)
+
+# Clips are resampled to the canvas sample rate once when they are processed, so mixing never has to resample
+def check_clip_sample_rate(clip:AudioClip, frameRate:int) -> None:
+    if clip.sampleRate != frameRate:
+        raise ValueError(f"Clip sample rate ({clip.sampleRate}) doesn't match the canvas sample rate ({frameRate}). Clips must be resampled before mixing.")
+
+
+class MixCanvas:
+    def __init__(self, durationMs:int, frameRate:int=48000):
+        self.frameRate = frameRate
+        self.durationMs = durationMs
+        self.buffer:ndarray = numpy.zeros(ms_to_samples(durationMs, frameRate), dtype=numpy.float32)
+
+    # Adds the samples into the buffer at the given start time. Anything past the end of the canvas is cut off, same as pydub overlay
+    def add_samples(self, samples:ndarray, startTimeMs:int|float|str) -> None:
+        startSample = ms_to_samples(startTimeMs, self.frameRate)
+        if startSample < 0:
+            samples = samples[-startSample:]
+            startSample = 0
+        endSample = min(startSample + len(samples), len(self.buffer))
+        if endSample <= startSample:
+            return
+        self.buffer[startSample:endSample] += samples[:endSample - startSample]
+
+    def add_clip(self, clip:AudioClip, startTimeMs:int|float|str) -> None:
+        check_clip_sample_rate(clip, self.frameRate)
+        self.add_samples(clip.samples, startTimeMs)
+
+    # Final step to clip the mixed audio and convert it to a pydub AudioSegment for exporting
+    def to_segment(self, channels:int=1) -> AudioSegment:
+        return samples_to_segment(self.buffer, self.frameRate, channels)
+
+
+# Starts a single ffmpeg process that takes raw mono float32 samples on stdin and encodes them straight to the output file
+def open_ffmpeg_encoder(outputFilePath:str, formatString:str, frameRate:int, channels:int=2, bitrate:str="192k", inputPath:str='pipe:0', inputFormat:str='f32le') -> subprocess.Popen[bytes]:
+    command = ['ffmpeg', '-y', '-loglevel', 'error', '-f', inputFormat, '-ar', str(frameRate), '-ac', '1', '-i', inputPath, '-ac', str(channels)]
+    if formatString == 'wav':
+        command += ['-c:a', 'pcm_s16le']
+    else:
+        command += ['-b:a', bitrate]
+    command += ['-f', formatString, outputFilePath]
+    return subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+# Encodes a file of raw 16 bit mono samples into the output format
+def encode_raw_pcm_file(rawFilePath:str, outputFilePath:str, formatString:str, frameRate:int, channels:int=2, bitrate:str="192k") -> None:
+    encoder = open_ffmpeg_encoder(outputFilePath, formatString, frameRate, channels, bitrate, inputPath=rawFilePath, inputFormat='s16le')
+    _, err = encoder.communicate()
+    if encoder.returncode != 0:
+        raise Exception(f'ffmpeg error: {err.decode()}')
+
+
+# Mixes clips one fixed size window at a time and pipes each finished window into an ffmpeg encoder
+# Only the current window and the clips overlapping it are kept in memory, so memory use doesn't depend on the video length
+# Clips must be added in order of their start time, which is the same order as the subtitles
+class StreamingMixer:
+    def __init__(self, durationMs:int, encoder:subprocess.Popen[bytes], frameRate:int=48000, windowSeconds:int=30):
+        self.frameRate = frameRate
+        self.durationMs = durationMs
+        self.encoder = encoder
+        self.totalSamples = ms_to_samples(durationMs, frameRate)
+        self.windowSamples = max(1, int(windowSeconds * frameRate))
+        self.flushedSamples = 0 # Everything before this sample index has already been sent to the encoder
+        self.pendingClips:list[tuple[int, ndarray]] = [] # (start sample, samples)
+
+    def add_samples(self, samples:ndarray, startTimeMs:int|float|str) -> None:
+        startSample = ms_to_samples(startTimeMs, self.frameRate)
+        # Any window that ends before this clip starts can't be changed by later clips, so it can be written out now
+        while self.flushedSamples + self.windowSamples <= min(startSample, self.totalSamples):
+            self._flush_window()
+
+        if startSample < self.flushedSamples:
+            # Shouldn't happen with subtitles in order, but the part that was already written can't be changed anymore
+            print(f"\nWARNING: Audio clip starting at {startTimeMs}ms is out of order and will be partially cut off.")
+            samples = samples[self.flushedSamples - startSample:]
+            startSample = self.flushedSamples
+        if len(samples) > 0 and startSample < self.totalSamples:
+            self.pendingClips.append((startSample, samples))
+
+    def add_clip(self, clip:AudioClip, startTimeMs:int|float|str) -> None:
+        check_clip_sample_rate(clip, self.frameRate)
+        self.add_samples(clip.samples, startTimeMs)
+
+    def _flush_window(self) -> None:
+        windowStart = self.flushedSamples
+        windowEnd = min(windowStart + self.windowSamples, self.totalSamples)
+        window = numpy.zeros(windowEnd - windowStart, dtype=numpy.float32)
+
+        stillPending:list[tuple[int, ndarray]] = []
+        for clipStart, clipSamples in self.pendingClips:
+            clipEnd = clipStart + len(clipSamples)
+            overlapStart = max(clipStart, windowStart)
+            overlapEnd = min(clipEnd, windowEnd)
+            if overlapEnd > overlapStart:
+                window[overlapStart - windowStart:overlapEnd - windowStart] += clipSamples[overlapStart - clipStart:overlapEnd - clipStart]
+            if clipEnd > windowEnd:
+                stillPending.append((clipStart, clipSamples))
+        self.pendingClips = stillPending
+
+        numpy.clip(window, -1.0, 1.0, out=window)
+        self.encoder.stdin.write(window.astype('<f4').tobytes()) # type: ignore[union-attr]
+        self.flushedSamples = windowEnd
+
+    # Writes out the remaining windows and waits for ffmpeg to finish encoding
+    def finish(self) -> None:
+        while self.flushedSamples < self.totalSamples:
+            self._flush_window()
+        self.pendingClips = []
+        self.encoder.stdin.close() # type: ignore[union-attr]
+        err = self.encoder.stderr.read() # type: ignore[union-attr]
+        if self.encoder.wait() != 0:
+            raise Exception(f'ffmpeg error: {err.decode()}')
+
+
+# ======================================== FFmpeg Filter Graph Rendering ================================================
+# Alternative to mixing in Python: a single ffmpeg process stretches every clip, delays it to its start time, and mixes them all
+
+# Returns the atempo filter for the speed factor. atempo can't go below 0.5, so lower factors are split into several chained filters
+def atempo_filter_chain(speedFactor:float) -> str:
+    min_speed_factor = 0.5
+    max_speed_factor = 100.0
+    filter_loop_count = 1
+
+    if speedFactor < min_speed_factor:
+        filter_loop_count = math.ceil(math.log(speedFactor) / math.log(min_speed_factor))
+        speedFactor = speedFactor ** (1 / filter_loop_count)
+        if speedFactor < 0.001:
+            raise ValueError(f"ERROR: Speed factor is extremely low, and likely an error. It was: {speedFactor}")
+    elif speedFactor > max_speed_factor:
+        raise ValueError(f"ERROR: Speed factor cannot be over 100. It was {speedFactor}.")
+    return ','.join([f'atempo={speedFactor}'] * filter_loop_count)
+
+@dataclass
+class FilterGraphClip:
+    filePath: str
+    startMs: int
+    speedFactor: Optional[float] = None # If None, the clip isn't stretched
+
+def build_filtergraph(clips:list[FilterGraphClip], frameRate:int, totalSamples:Optional[int]=None) -> str:
+    filterLines:list[str] = []
+    for index, clip in enumerate(clips):
+        chain = [f'aresample={frameRate}', 'aformat=channel_layouts=mono']
+        if clip.speedFactor is not None:
+            chain.append(atempo_filter_chain(clip.speedFactor))
+        chain.append(f'adelay=delays={max(0, int(clip.startMs))}:all=1')
+        filterLines.append(f'[{index}:a]' + ','.join(chain) + f'[a{index}]')
+
+    # normalize=0 keeps amix from lowering the volume of each input based on the number of inputs
+    mixInputs = ''.join(f'[a{index}]' for index in range(len(clips)))
+    mixFilter = f'{mixInputs}amix=inputs={len(clips)}:duration=longest:dropout_transition=0:normalize=0'
+    if totalSamples is not None:
+        # Pad or cut the result to be exactly the length of the video
+        mixFilter += f',apad=whole_len={totalSamples},atrim=end_sample={totalSamples}'
+    filterLines.append(mixFilter + '[out]')
+    return ';\n'.join(filterLines)
+
+def run_filtergraph(clips:list[FilterGraphClip], outputFilePath:str, outputOptions:list[str], frameRate:int, durationMs:Optional[int], tempFolder:str) -> None:
+    totalSamples = ms_to_samples(durationMs, frameRate) if durationMs is not None else None
+    command = ['ffmpeg', '-y', '-loglevel', 'error']
+    if len(clips) == 0:
+        # Nothing to mix, so just output silence of the right length
+        command += ['-f', 'lavfi', '-i', f'anullsrc=r={frameRate}:cl=mono', '-t', str((durationMs or 0) / 1000)]
+    else:
+        for clip in clips:
+            command += ['-i', clip.filePath]
+        # The filter graph can get very long, so it's passed in a file instead of on the command line
+        filterScriptPath = os.path.join(tempFolder, f'filtergraph_{os.getpid()}.txt')
+        with open(filterScriptPath, 'w', encoding='utf-8') as f:
+            f.write(build_filtergraph(clips, frameRate, totalSamples))
+        command += ['-filter_complex_script', filterScriptPath, '-map', '[out]']
+    command += outputOptions + [outputFilePath]
+
+    process = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if process.returncode != 0:
+        raise Exception(f'ffmpeg error: {process.stderr.decode()}')
+
+# Renders all the clips into the final output file with as few ffmpeg processes as possible
+# If there are more clips than maxInputs, consecutive groups of clips are first mixed into intermediate files that only cover
+# the time span of that group, then those are mixed together the same way
+def render_with_filtergraph(clips:list[FilterGraphClip], durationMs:int, outputFilePath:str, formatString:str, frameRate:int=48000, channels:int=2, bitrate:str="192k", maxInputs:int=200, tempFolder:str="workingFolder", _depth:int=0) -> None:
+    maxInputs = max(2, maxInputs)
+    if len(clips) > maxInputs:
+        clips = sorted(clips, key=lambda clip: clip.startMs)
+        groupClips:list[FilterGraphClip] = []
+        for groupNum, groupStart in enumerate(range(0, len(clips), maxInputs)):
+            group = clips[groupStart:groupStart + maxInputs]
+            groupStartMs = min(clip.startMs for clip in group)
+            shiftedGroup = [FilterGraphClip(clip.filePath, clip.startMs - groupStartMs, clip.speedFactor) for clip in group]
+            groupFilePath = os.path.join(tempFolder, f'filtergraph_group_{_depth}_{groupNum}.wav')
+            # Intermediate files are 32 bit float so nothing gets clipped before the final mix
+            run_filtergraph(shiftedGroup, groupFilePath, ['-c:a', 'pcm_f32le', '-f', 'wav'], frameRate, None, tempFolder)
+            groupClips.append(FilterGraphClip(groupFilePath, groupStartMs, None))
+        render_with_filtergraph(groupClips, durationMs, outputFilePath, formatString, frameRate, channels, bitrate, maxInputs, tempFolder, _depth + 1)
+        return
+
+    outputOptions = ['-ac', str(channels)]
+    if formatString == 'wav':
+        outputOptions += ['-c:a', 'pcm_s16le']
+    else:
+        outputOptions += ['-b:a', bitrate]
+    outputOptions += ['-f', formatString]
+    run_filtergraph(clips, outputFilePath, outputOptions, frameRate, durationMs, tempFolder)
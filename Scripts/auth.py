@@ -27,6 +27,7 @@ token_file_name = 'token.pickle'
 youtube_token_filename = 'yt_token.pickle'
 GOOGLE_TTS_API:Optional[object] = None
 GOOGLE_TRANSLATE_API:Optional[object] = None
+GOOGLE_CREDENTIALS:Optional[object] = None
 YOUTUBE_API:Optional[object] = None
 
 # deepl Globals
@@ -51,6 +52,7 @@ def get_authenticated_service(youtubeAuth: Literal[False], specifySecretsFile:Op
 def get_authenticated_service(youtubeAuth: bool = False, specifySecretsFile:Optional[str]=None) -> Union[object, Tuple[object, object]]:
   global GOOGLE_TTS_API
   global GOOGLE_TRANSLATE_API
+  global GOOGLE_CREDENTIALS
   CLIENT_SECRETS_FILE = 'client_secrets.json'
   YOUTUBE_CLIENT_SECRETS_FILE = 'yt_client_secrets.json'
   GOOGLE_API_SCOPES = ['https://www.googleapis.com/auth/cloud-platform', 'https://www.googleapis.com/auth/cloud-translation']
@@ -135,6 +137,7 @@ def get_authenticated_service(youtubeAuth: bool = False, specifySecretsFile:Opti
 
   # Build tts and translate API objects
   # Credentials and http parameter for build are mutually exclusive
+  GOOGLE_CREDENTIALS = creds
   if cloudConfig.google_translate_mode == GoogleTranslateMode.LLM:
     # For LLM mode increase timeout because it takes longer. Create HTTP object with increased timeout (default is socket timeout, typically 60s)
     http = google_auth_httplib2.AuthorizedHttp(creds, http=httplib2.Http(timeout=300))  # 5 minutes timeout
@@ -151,6 +154,10 @@ def get_authenticated_service(youtubeAuth: bool = False, specifySecretsFile:Opti
   else:
     raise Exception("Failed to build Google TTS or Translate API service")
 
+# The API objects share one http connection, which isn't thread safe. Each thread making requests needs its own, passed to execute(http=...)
+def new_google_http() -> object:
+  return google_auth_httplib2.AuthorizedHttp(GOOGLE_CREDENTIALS, http=httplib2.Http(timeout=300)) # type: ignore
+
 def youtube_authentication(specifySecretsFile:Optional[str] = None):
   global YOUTUBE_API
   try:
@@ -8,6 +8,7 @@
 #--------------------------------------------------------------------------------------------------------
 import json
 import logging
+import random
 import sys
 import uuid
 from typing import Optional
@@ -33,6 +34,52 @@ DESCRIPTION = "Simple synthesis description"
 # The service host suffix.
 SERVICE_HOST = "api.cognitive.microsoft.com"
 
+# Polling starts often, since small jobs finish quickly, then backs off exponentially
+# Random jitter keeps the polls for multiple jobs from all landing at the same moment
+POLL_INITIAL_DELAY = 2.0 # Seconds
+POLL_MAX_DELAY = 30.0
+POLL_BACKOFF_FACTOR = 1.5
+
+def next_poll_delay(previousDelay:float) -> float:
+    return min(POLL_MAX_DELAY, previousDelay * POLL_BACKOFF_FACTOR) * random.uniform(0.8, 1.2)
+
+# Azure TTS Batch requests require payload must be under 500 kilobytes. Not sure if they actually mean kibibytes, assume worst case
+# Leave some room for anything unexpected. Also number of inputs must be below 1000
+MAX_PAYLOAD_BYTES = 495000
+MAX_PAYLOAD_INPUTS = 995
+
+# Packs the SSML for each line into as few payloads as possible, in a single pass
+# The size of the serialized payload is kept as a running count, instead of serializing it again for every line added
+# Each line's size is exactly what it adds to json.dumps(payload), because json.dumps separates list items with ', '
+# Returns each payload along with the keys of the lines in it, in input order
+def plan_payloads(basePayload:dict, ssmlList:list[tuple[int, str]]) -> list[tuple[dict, list[int]]]:
+    baseSize = len(json.dumps({**basePayload, 'inputs': []}).encode('utf-8'))
+    payloadList:list[tuple[dict, list[int]]] = []
+    inputs:list[dict] = []
+    keys:list[int] = []
+    payloadSize = baseSize
+
+    def finish_payload() -> None:
+        payloadList.append(({**basePayload, 'inputs': inputs}, keys))
+
+    for key, ssml in ssmlList:
+        entry = {"content": ssml}
+        entrySize = len(json.dumps(entry).encode('utf-8'))
+        addedSize = entrySize + (2 if inputs else 0)
+        if inputs and (payloadSize + addedSize > MAX_PAYLOAD_BYTES or len(inputs) >= MAX_PAYLOAD_INPUTS):
+            finish_payload()
+            inputs, keys, payloadSize = [], [], baseSize
+            addedSize = entrySize
+        if baseSize + entrySize > MAX_PAYLOAD_BYTES:
+            print(f"WARNING: The text for line {key} is too long to fit in an Azure batch request on its own, so it will likely fail.")
+        inputs.append(entry)
+        keys.append(key)
+        payloadSize += addedSize
+
+    if inputs:
+        finish_payload()
+    return payloadList
+
 def _create_job_id():
     # the job ID must be unique in current speech resource
     # you can use a GUID or a self-increasing number
@@ -0,0 +1,216 @@
+import os
+import atexit
+import threading
+import multiprocessing
+import subprocess
+import collections
+import concurrent.futures
+from dataclasses import dataclass, replace
+from platform import system as sysPlatform
+from typing import Callable, Iterator, Iterable, Optional
+
+import numpy
+import soundfile
+import pyrubberband
+from numpy import ndarray
+
+from Scripts.enums import AudioStretchMethod
+import Scripts.audio_mixer as audio_mixer
+import Scripts.audio_dsp as audio_dsp
+from Scripts.audio_clip import AudioClip
+from Scripts.disk_cache import DiskCache, CacheStats
+
+# This module is imported by the worker processes, so it must stay lightweight and never import TTS or auth
+# Everything a worker needs is passed in through the ClipJob, so results don't depend on the state of the worker process
+
+# If macOS, add current working directory to path for session for rubberband
+if sysPlatform() == "Darwin":
+    os.environ['PATH'] += os.pathsep + os.getcwd()
+
+# Settings for processing a single synthesized clip
+@dataclass
+class ClipJob:
+    key: int
+    filePath: str
+    desiredDurationMs: float
+    targetFrameRate: int
+    stretch: bool # Whether to stretch the clip to the desired duration
+    stretchMethod: AudioStretchMethod
+    silenceThresholdDb: float = -50.0
+    silencePaddingMs: int = 0
+    measureOnly: bool = False # Only calculate the speed factor, don't return any audio
+    trimmedFilePath: Optional[str] = None # If set, the trimmed clip is saved here as a wav file
+    cacheFolder: Optional[str] = None # If set, trimmed and stretched clips are cached here across runs
+    debugFileStem: Optional[str] = None # If set, intermediate files are saved using this path + suffix
+
+@dataclass
+class ClipResult:
+    key: int
+    speedFactor: float
+    trimmedDurationMs: float
+    clip: Optional[AudioClip] = None # At the job's targetFrameRate, ready to mix
+    cacheHits: int = 0
+    cacheMisses: int = 0
+
+    @property
+    def duration_ms(self) -> float:
+        if self.clip is None:
+            return 0
+        return self.clip.duration_ms
+
+
+def stretch_with_rubberband(y, sampleRate, speedFactor):
+    rubberband_streched_audio = pyrubberband.time_stretch(y, sampleRate, speedFactor, rbargs={'--fine': '--fine'}) # Need to add rbarges in weird way because it demands a dictionary of two values
+    return rubberband_streched_audio
+
+def stretch_with_ffmpeg(samples:ndarray, sampleRate:int, speed_factor:float) -> ndarray:
+    # Prepare ffmpeg command. Raw float samples go in and out, so nothing needs to be encoded or decoded as wav
+    atempoFilter = audio_mixer.atempo_filter_chain(speed_factor)
+    command = ['ffmpeg', '-f', 'f32le', '-ar', str(sampleRate), '-ac', '1', '-i', 'pipe:0', '-filter:a', atempoFilter, '-f', 'f32le', '-ac', '1', 'pipe:1']
+    process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    # Pass the audio data to ffmpeg and read the processed data
+    out, err = process.communicate(input=numpy.asarray(samples, dtype='<f4').tobytes())
+
+    # Check for errors
+    if process.returncode != 0:
+        raise Exception(f'ffmpeg error: {err.decode()}')
+
+    return numpy.frombuffer(out, dtype='<f4').copy()
+
+# Stretches the clip using the chosen method. The samples are passed directly as numpy arrays
+def stretch_clip(clip:AudioClip, speedFactor:float, stretchMethod:AudioStretchMethod, debugFileStem:Optional[str]=None) -> AudioClip:
+    samples, sampleRate = clip.samples, clip.sampleRate
+    if stretchMethod == AudioStretchMethod.WSOLA:
+        # Runs in-process, so no subprocess or temporary files are needed
+        stretched_audio = audio_dsp.wsola_stretch(samples, sampleRate, speedFactor)
+    elif stretchMethod == AudioStretchMethod.FFMPEG:
+        stretched_audio = stretch_with_ffmpeg(samples, sampleRate, speedFactor)
+    elif stretchMethod == AudioStretchMethod.RUBBERBAND:
+        stretched_audio = stretch_with_rubberband(samples, sampleRate, speedFactor).astype(numpy.float32)
+    else:
+        raise ValueError(f"Unknown audio stretch method: {stretchMethod}")
+
+    if debugFileStem:
+        # For debugging, save the stretched audio file
+        soundfile.write(f'{debugFileStem}_stretched_{stretchMethod}.wav', stretched_audio, sampleRate)
+    return AudioClip(stretched_audio, sampleRate)
+
+# Returns the clip from the cache if it's there, otherwise creates it and adds it to the cache
+def get_or_create_clip(cache:Optional[DiskCache], key:str, create:Callable[[], AudioClip]) -> AudioClip:
+    if cache is None:
+        return create()
+    cachedData = cache.get(key)
+    if cachedData is not None:
+        return AudioClip.from_bytes(cachedData)
+    clip = create()
+    cache.put(key, clip.to_bytes())
+    return clip
+
+# Trims, measures and (if required) stretches a single clip. This is what runs inside each worker process
+def process_clip(job:ClipJob) -> ClipResult:
+    cache = DiskCache(job.cacheFolder) if job.cacheFolder else None
+
+    # The trimmed clip depends only on the source audio and the trim settings
+    # This is the only time the clip gets decoded, everything after works on the samples
+    trimKey = DiskCache.make_key('trimmed', DiskCache.hash_file(job.filePath), job.silenceThresholdDb, job.silencePaddingMs) if cache else ''
+
+    # If only the duration is needed and the trimmed clip is already cached, its duration can be read from the header without decoding it
+    if cache and job.measureOnly and not job.trimmedFilePath and not job.debugFileStem:
+        cachedPath = cache.get_path(trimKey)
+        if cachedPath is not None:
+            trimmedDurationMs = AudioClip.read_duration_ms(cachedPath)
+            return ClipResult(key=job.key, speedFactor=trimmedDurationMs / float(job.desiredDurationMs), trimmedDurationMs=trimmedDurationMs, cacheHits=cache.hits, cacheMisses=cache.misses)
+        trimmedClip = AudioClip.from_file(job.filePath).trimmed(job.silenceThresholdDb, job.silencePaddingMs)
+        cache.put(trimKey, trimmedClip.to_bytes())
+    else:
+        trimmedClip = get_or_create_clip(cache, trimKey, lambda: AudioClip.from_file(job.filePath).trimmed(job.silenceThresholdDb, job.silencePaddingMs))
+    if job.debugFileStem:
+        trimmedClip.save(f'{job.debugFileStem}_trimmed.wav')
+    if job.trimmedFilePath:
+        trimmedClip.save(job.trimmedFilePath, subtype='FLOAT')
+
+    # Calculate the speed factor, aka how much to stretch the audio
+    trimmedDurationMs = trimmedClip.duration_ms
+    speedFactor = trimmedDurationMs / float(job.desiredDurationMs)
+    result = ClipResult(key=job.key, speedFactor=speedFactor, trimmedDurationMs=trimmedDurationMs)
+
+    if not job.measureOnly:
+        if job.stretch:
+            stretchKey = DiskCache.make_key('stretched', trimKey, speedFactor, str(job.stretchMethod)) if cache else ''
+            finalClip = get_or_create_clip(cache, stretchKey, lambda: stretch_clip(trimmedClip, speedFactor, job.stretchMethod, job.debugFileStem))
+        else:
+            finalClip = trimmedClip
+        result.clip = finalClip.resampled(job.targetFrameRate)
+
+    if cache:
+        result.cacheHits, result.cacheMisses = cache.hits, cache.misses
+    return result
+
+
+# Measures the trimmed duration of every clip and calculates all the speed factors at once
+# Returns the keys in job order, and the matching trimmed durations and speed factors as arrays
+def measure_speed_factors(jobs:list[ClipJob], workers:int=1, cacheStats:Optional[CacheStats]=None) -> tuple[list[int], ndarray, ndarray]:
+    trimmedDurations = numpy.empty(len(jobs), dtype=numpy.float64)
+    for index, result in enumerate(iter_processed_clips([replace(job, measureOnly=True) for job in jobs], workers, cacheStats)):
+        trimmedDurations[index] = result.trimmedDurationMs
+        print(f" Trimmed Audio and Calculated Speed Factor: {index+1} of {len(jobs)}", end="\r")
+    print("\n")
+    desiredDurations = numpy.array([job.desiredDurationMs for job in jobs], dtype=numpy.float64)
+    return [job.key for job in jobs], trimmedDurations, trimmedDurations / desiredDurations
+
+def resolve_worker_count(setting:int|str) -> int:
+    if isinstance(setting, str): # 'auto'
+        return os.cpu_count() or 1
+    return max(1, setting)
+
+# One pool of worker processes is kept for the whole run, and shared by every pass and every language, so the workers are only started once
+# The workers are started fresh (spawn) rather than forked, because forking a process that has other threads running, such as concurrent languages
+# and the TTS event loop, can leave a lock held forever in the child. Spawned workers import main.py again, which only runs anything when started directly
+_processPool:Optional[concurrent.futures.ProcessPoolExecutor] = None
+_processPoolLock = threading.Lock()
+
+def get_process_pool(workers:int) -> concurrent.futures.ProcessPoolExecutor:
+    global _processPool
+    with _processPoolLock:
+        if _processPool is None:
+            _processPool = concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        return _processPool
+
+def shutdown_process_pool() -> None:
+    global _processPool
+    with _processPoolLock:
+        if _processPool is not None:
+            _processPool.shutdown(cancel_futures=True)
+            _processPool = None
+
+atexit.register(shutdown_process_pool)
+
+# Processes the clips using a pool of worker processes, and yields the results in the same order as the jobs
+# Only a limited number of jobs are submitted ahead of the one being yielded, so finished audio doesn't pile up in memory
+def iter_processed_clips(jobs:Iterable[ClipJob], workers:int=1, cacheStats:Optional[CacheStats]=None) -> Iterator[ClipResult]:
+    for result in _iter_processed_clips(jobs, workers):
+        if cacheStats is not None:
+            cacheStats.add(result.cacheHits, result.cacheMisses)
+        yield result
+
+def _iter_processed_clips(jobs:Iterable[ClipJob], workers:int) -> Iterator[ClipResult]:
+    if workers <= 1:
+        for job in jobs:
+            yield process_clip(job)
+        return
+
+    maxInFlight = workers * 4
+    executor = get_process_pool(workers)
+    inFlight:collections.deque[concurrent.futures.Future[ClipResult]] = collections.deque()
+    try:
+        for job in jobs:
+            inFlight.append(executor.submit(process_clip, job))
+            if len(inFlight) >= maxInFlight:
+                yield inFlight.popleft().result()
+        while inFlight:
+            yield inFlight.popleft().result()
+    finally:
+        # The pool is shared, so if this stops early, only cancel the jobs this call submitted
+        for future in inFlight:
+            future.cancel()
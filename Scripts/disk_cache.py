@@ -0,0 +1,124 @@
+import os
+import hashlib
+import tempfile
+from dataclasses import dataclass
+from typing import Optional
+
+# A simple content-addressed cache of files on disk
+# Entries are stored as one file per key, named by a hash of whatever went into producing them, so stale entries are never returned
+# The modified time of each file is updated when it is read, and the least recently used files are deleted once the folder is over the size limit
+# Several processes can use the same cache folder at once, since files are only ever written atomically
+
+class DiskCache:
+    def __init__(self, folder:str, maxSizeMB:Optional[float]=None):
+        self.folder = folder
+        self.maxSizeBytes = int(maxSizeMB * 1024 * 1024) if maxSizeMB is not None else None
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.folder, exist_ok=True)
+
+    # Creates a key from any number of parts. Bytes are hashed as-is, anything else is hashed by its string representation
+    @staticmethod
+    def make_key(*parts:object) -> str:
+        hasher = hashlib.sha256()
+        for part in parts:
+            data = part if isinstance(part, bytes) else repr(part).encode('utf-8')
+            # Include the length so different splits of the same data can't produce the same key
+            hasher.update(len(data).to_bytes(8, 'little'))
+            hasher.update(data)
+        return hasher.hexdigest()
+
+    @staticmethod
+    def hash_file(filePath:str) -> str:
+        hasher = hashlib.sha256()
+        with open(filePath, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                hasher.update(chunk)
+        return hasher.hexdigest()
+
+    def _path(self, key:str) -> str:
+        return os.path.join(self.folder, key[:2], key)
+
+    def get(self, key:str) -> Optional[bytes]:
+        filePath = self._path(key)
+        try:
+            with open(filePath, 'rb') as f:
+                data = f.read()
+        except OSError:
+            self.misses += 1
+            return None
+        try:
+            os.utime(filePath) # Mark as recently used
+        except OSError:
+            pass
+        self.hits += 1
+        return data
+
+    # Returns the path of the entry without reading it, or None if it isn't cached. Counts as a hit or miss the same as get
+    def get_path(self, key:str) -> Optional[str]:
+        filePath = self._path(key)
+        try:
+            os.utime(filePath) # Mark as recently used, which also checks it exists
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return filePath
+
+    def put(self, key:str, data:bytes) -> None:
+        filePath = self._path(key)
+        os.makedirs(os.path.dirname(filePath), exist_ok=True)
+        # Write to a temporary file first, so other processes never see a partially written entry
+        fileDescriptor, tempPath = tempfile.mkstemp(dir=os.path.dirname(filePath), suffix='.tmp')
+        try:
+            with os.fdopen(fileDescriptor, 'wb') as f:
+                f.write(data)
+            os.replace(tempPath, filePath)
+        except OSError:
+            if os.path.exists(tempPath):
+                os.remove(tempPath)
+
+    # Deletes the least recently used entries until the cache is under the size limit. Returns the number of entries deleted
+    def enforce_size_limit(self) -> int:
+        if self.maxSizeBytes is None:
+            return 0
+        entries:list[tuple[float, int, str]] = []
+        totalSize = 0
+        for root, _dirs, files in os.walk(self.folder):
+            for fileName in files:
+                filePath = os.path.join(root, fileName)
+                try:
+                    stat = os.stat(filePath)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, filePath))
+                totalSize += stat.st_size
+
+        deletedCount = 0
+        entries.sort()
+        for _mtime, size, filePath in entries:
+            if totalSize <= self.maxSizeBytes:
+                break
+            try:
+                os.remove(filePath)
+                totalSize -= size
+                deletedCount += 1
+            except OSError:
+                pass
+        return deletedCount
+
+
+# Hit and miss counts added up from all the processes using a cache
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+
+    def add(self, hits:int, misses:int) -> None:
+        self.hits += hits
+        self.misses += misses
+
+    def summary(self, cacheName:str) -> str:
+        total = self.hits + self.misses
+        hitPercent = round(self.hits / total * 100) if total else 0
+        return f"{cacheName}: {self.hits} hits, {self.misses} misses ({hitPercent}% hit rate)"
@@ -39,10 +39,26 @@ class AudioFormat(str, enum.Enum):
 class AudioStretchMethod(str, enum.Enum):
     FFMPEG = "ffmpeg"
     RUBBERBAND = "rubberband"
+    WSOLA = "wsola"
     
     def __str__(self):
         return self.value
 
+class AudioRenderMode(str, enum.Enum):
+    CANVAS = "canvas"
+    STREAMING = "streaming"
+    FILTERGRAPH = "filtergraph"
+    
+    def __str__(self):
+        return self.value
+
+class TTSAudioFormat(str, enum.Enum):
+    MP3 = "mp3"
+    PCM = "pcm"
+
+    def __str__(self):
+        return self.value
+
 class ElevenLabsModel(str, enum.Enum):
     MONOLINGUAL_V1 = "eleven_monolingual_v1"
     MULTILINGUAL_V2 = "eleven_multilingual_v2"
@@ -81,6 +97,7 @@ class LangDictKeys(str, enum.Enum):
     formality = "formality"
     voiceModel = "voiceModel"
     voiceStyle = "voiceStyle"
+    workingFolder = "workingFolder"
     
     def __str__(self):
         return self.value
@@ -102,6 +119,7 @@ class SubsDictKeys(str, enum.Enum):
     TTS_FilePath = "TTS_FilePath"
     TTS_FilePath_Trimmed = "TTS_FilePath_Trimmed"
     speed_factor = "speed_factor"
+    first_pass_speaking_rate = "first_pass_speaking_rate"
     force_split_at_start = "force_split_at_start"
     force_split_at_end = "force_split_at_end"
 
@@ -0,0 +1,154 @@
+import os
+import json
+import shutil
+from typing import Any
+
+import numpy
+import soundfile
+
+from Scripts.shared_imports import *
+from Scripts.audio_clip import AudioClip
+from Scripts.disk_cache import DiskCache
+import Scripts.audio_mixer as audio_mixer
+import Scripts.pronunciation as pronunciation
+
+# Incremental rendering: Keeps the rendered track and each line's final clip from the last run of a language,
+# so when only a few lines change, only those lines are synthesized and stretched again, and only their parts of the track are re-mixed
+# Lines are matched by a signature of everything that affects their audio (text, timing, voice and audio settings), not by line number,
+# because editing one line can change how the lines after it get combined and numbered
+
+INCREMENTAL_FOLDER = os.path.join(CACHE_DIRECTORY, 'Incremental')
+MANIFEST_VERSION = 1
+
+# Returns a signature of everything that affects how the audio for a line comes out
+# pronunciationSignature identifies the pronunciation override files, which change the text actually sent to the TTS service
+def line_signature(entry:SubtitleEntry, langDict:dict[LangDictKeys, Any], pronunciationSignature:str) -> str:
+    return DiskCache.make_key(
+        entry[SubsDictKeys.translated_text],
+        str(entry[SubsDictKeys.start_ms]),
+        str(entry[SubsDictKeys.duration_ms]),
+        str(entry.get(SubsDictKeys.duration_ms_buffered, '')),
+        str(cloudConfig.tts_service),
+        [str(langDict[langKey]) for langKey in (LangDictKeys.languageCode, LangDictKeys.voiceName, LangDictKeys.voiceGender, LangDictKeys.voiceModel, LangDictKeys.voiceStyle)],
+        [str(config.local_audio_stretch_method), config.silence_trim_threshold_db, config.silence_trim_padding_ms, config.two_pass_voice_synth, config.two_pass_tolerance,
+         config.force_stretch_with_twopass, config.force_always_stretch, str(config.azure_sentence_pause), str(config.azure_comma_pause), str(config.tts_audio_format),
+         config.synth_audio_encoding.upper()],
+        pronunciationSignature,
+    )
+
+class IncrementalRenderStore:
+    def __init__(self, langDict:dict[LangDictKeys, Any], totalAudioLength:int, frameRate:int=48000):
+        self.langDict = langDict
+        self.totalAudioLength = totalAudioLength
+        self.frameRate = frameRate
+        self.folder = os.path.join(INCREMENTAL_FOLDER, f"{ORIGINAL_VIDEO_NAME} - {langDict[LangDictKeys.languageCode]}")
+        self.clipsFolder = os.path.join(self.folder, 'clips')
+        self.manifestPath = os.path.join(self.folder, 'manifest.json')
+        self.mixPath = os.path.join(self.folder, 'mix.s16') # Raw 16 bit mono samples of the whole track
+
+        self.previousLines:dict[str, dict[str, int]] = {} # Signature -> {startSample, numSamples}
+        self.signatures:dict[int, str] = {}
+        self.changedKeys:list[int] = []
+        self.fullRender = True
+        self._load_manifest()
+
+    def _load_manifest(self) -> None:
+        try:
+            with open(self.manifestPath, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return
+        # The previous track can only be patched if it was rendered with the same length and sample rate
+        if manifest.get('version') != MANIFEST_VERSION or manifest.get('totalAudioLength') != self.totalAudioLength \
+            or manifest.get('frameRate') != self.frameRate or not os.path.isfile(self.mixPath):
+            return
+        self.previousLines = manifest['lines']
+        self.fullRender = False
+
+    # Works out which lines need to be synthesized and rendered again. Returns their keys
+    def find_changed_keys(self, subsDict:SubtitleDict) -> list[int]:
+        pronunciationSignature = pronunciation.overrides_signature()
+        self.signatures = {key: line_signature(value, self.langDict, pronunciationSignature) for key, value in subsDict.items()}
+        if self.fullRender:
+            self.changedKeys = list(subsDict.keys())
+        else:
+            self.changedKeys = [key for key, signature in self.signatures.items()
+                                if signature not in self.previousLines or not os.path.isfile(self._clip_path(signature))]
+        return self.changedKeys
+
+    def _clip_path(self, signature:str) -> str:
+        return os.path.join(self.clipsFolder, f'{signature}.wav')
+
+    # Saves the final (stretched, at canvas sample rate) clip of a line that was rendered this run
+    def save_clip(self, key:int, clip:AudioClip) -> None:
+        audio_mixer.check_clip_sample_rate(clip, self.frameRate)
+        os.makedirs(self.clipsFolder, exist_ok=True)
+        clip.save(self._clip_path(self.signatures[key]), subtype='PCM_16')
+
+    # Re-mixes the parts of the track where lines were added, removed or changed, then saves the manifest
+    def update_mix(self, subsDict:SubtitleDict) -> None:
+        totalSamples = audio_mixer.ms_to_samples(self.totalAudioLength, self.frameRate)
+        os.makedirs(self.folder, exist_ok=True)
+
+        # Find where every current line sits in the track
+        currentLines:dict[str, dict[str, int]] = {}
+        for key, value in subsDict.items():
+            signature = self.signatures[key]
+            currentLines[signature] = {'startSample': audio_mixer.ms_to_samples(value[SubsDictKeys.start_ms], self.frameRate),
+                                       'numSamples': soundfile.info(self._clip_path(signature)).frames}
+
+        if self.fullRender:
+            dirtyRegions = [(0, totalSamples)]
+            mix = numpy.memmap(self.mixPath, dtype='<i2', mode='w+', shape=(totalSamples,))
+        else:
+            # Regions covered by lines that are gone, and by lines that are new or changed
+            dirtyRegions = [(line['startSample'], line['startSample'] + line['numSamples']) for signature, line in self.previousLines.items() if signature not in currentLines]
+            for key in self.changedKeys:
+                line = currentLines[self.signatures[key]]
+                dirtyRegions.append((line['startSample'], line['startSample'] + line['numSamples']))
+            dirtyRegions = merge_regions(dirtyRegions, totalSamples)
+            mix = numpy.memmap(self.mixPath, dtype='<i2', mode='r+', shape=(totalSamples,))
+
+        sortedLines = sorted(currentLines.items(), key=lambda item: item[1]['startSample'])
+        for regionStart, regionEnd in dirtyRegions:
+            region = numpy.zeros(regionEnd - regionStart, dtype=numpy.float32)
+            for signature, line in sortedLines:
+                lineStart, lineEnd = line['startSample'], line['startSample'] + line['numSamples']
+                if lineStart >= regionEnd:
+                    break
+                if lineEnd <= regionStart:
+                    continue
+                clip = AudioClip.from_file(self._clip_path(signature))
+                overlapStart, overlapEnd = max(lineStart, regionStart), min(lineEnd, regionEnd)
+                region[overlapStart - regionStart:overlapEnd - regionStart] += clip.samples[overlapStart - lineStart:overlapEnd - lineStart]
+            mix[regionStart:regionEnd] = numpy.frombuffer(audio_mixer.samples_to_pcm16(region), dtype='<i2')
+        mix.flush()
+        del mix
+
+        # Remove clips of lines that aren't used anymore
+        for signature in self.previousLines:
+            if signature not in currentLines and os.path.isfile(self._clip_path(signature)):
+                os.remove(self._clip_path(signature))
+
+        with open(self.manifestPath, 'w', encoding='utf-8') as f:
+            json.dump({'version': MANIFEST_VERSION, 'totalAudioLength': self.totalAudioLength, 'frameRate': self.frameRate, 'lines': currentLines}, f)
+
+    def export(self, outputFileName:str, formatString:str) -> None:
+        audio_mixer.encode_raw_pcm_file(self.mixPath, outputFileName, formatString, frameRate=self.frameRate, channels=2, bitrate="192k")
+
+    # Deletes everything stored for this language, so the next run renders from scratch
+    def clear(self) -> None:
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+
+# Sorts the regions and merges any that overlap, also limiting them to the length of the track
+def merge_regions(regions:list[tuple[int, int]], totalSamples:int) -> list[tuple[int, int]]:
+    merged:list[tuple[int, int]] = []
+    for start, end in sorted((max(0, start), min(totalSamples, end)) for start, end in regions):
+        if end <= start:
+            continue
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
@@ -0,0 +1,106 @@
+import sys
+import builtins
+import threading
+import traceback
+import contextvars
+import concurrent.futures
+from dataclasses import dataclass
+from typing import Callable, Optional, TextIO
+
+# Runs several languages at the same time, each in its own thread
+# Most of the time spent on a language is waiting for the translation and TTS services, so threads are enough to overlap the languages
+# The TTS rate limiters, connection pools and caches are module level objects, so they're shared by every language automatically
+
+# The file that print output from the current language goes to. Threads started for a language must copy the context to keep using it
+_languageOutput:contextvars.ContextVar[Optional[TextIO]] = contextvars.ContextVar('languageOutput', default=None)
+_currentJob:contextvars.ContextVar[Optional['LanguageJob']] = contextvars.ContextVar('currentJob', default=None)
+_consoleLock = threading.Lock()
+_inputLock = threading.Lock() # Only one language asks a question at a time, so it's clear which one the answer is for
+
+# Replaces sys.stdout while languages run concurrently, so each language's messages and progress lines go to its own log file
+class RoutedOutput:
+    def __init__(self, console:TextIO):
+        self.console = console
+
+    def write(self, text:str) -> int:
+        target = _languageOutput.get()
+        if target is None:
+            with _consoleLock:
+                return self.console.write(text)
+        return target.write(text)
+
+    def flush(self) -> None:
+        target = _languageOutput.get()
+        (target or self.console).flush()
+
+    def __getattr__(self, name:str):
+        return getattr(self.console, name)
+
+def _get_console() -> TextIO:
+    return sys.stdout.console if isinstance(sys.stdout, RoutedOutput) else sys.stdout
+
+# Prints straight to the console, even from inside a language
+def print_to_console(message:str) -> None:
+    console = _get_console()
+    with _consoleLock:
+        console.write(message + "\n")
+        console.flush()
+
+# Replaces input() while languages run concurrently. Otherwise the question would go to the language's log file, while the program waits for an answer
+# The question is asked on the console, saying which language it's from. Whatever led up to it (such as an error message) is in the log file
+def console_input(prompt:object='') -> str:
+    job = _currentJob.get()
+    logFile = _languageOutput.get()
+    if job is None or logFile is None:
+        return _originalInput(prompt)
+    logFile.write(f"{prompt}")
+    with _inputLock:
+        console = _get_console()
+        with _consoleLock:
+            console.write(f"\n{job.name} is asking (see {job.logPath} for details):\n{prompt}")
+            console.flush()
+        answer = sys.stdin.readline()
+    if not answer: # Same as input() when there's nothing more to read
+        raise EOFError
+    logFile.write(answer)
+    return answer.rstrip('\n')
+
+_originalInput = builtins.input
+
+@dataclass
+class LanguageJob:
+    name: str # Shown on the console when the language starts and finishes
+    logPath: str # Where the language's output goes when running more than one at a time
+    run: Callable[[], None]
+
+# Runs the jobs with up to maxConcurrent at once. With 1, they just run one after another like normal
+def run_languages(jobs:list[LanguageJob], maxConcurrent:int) -> None:
+    if maxConcurrent <= 1 or len(jobs) <= 1:
+        for job in jobs:
+            job.run()
+        return
+
+    def run_job(job:LanguageJob) -> None:
+        with open(job.logPath, 'w', encoding='utf-8', buffering=1) as logFile:
+            _languageOutput.set(logFile)
+            _currentJob.set(job)
+            print_to_console(f"Started: {job.name}  (Log file: {job.logPath})")
+            try:
+                job.run()
+            except BaseException as e: # Includes SystemExit, which the error handling elsewhere uses to stop the program
+                traceback.print_exc(file=logFile)
+                print_to_console(f"FAILED: {job.name} - {type(e).__name__}: {e}  (See the log file for details)")
+                return
+        print_to_console(f"Finished: {job.name}")
+
+    originalStdout = sys.stdout
+    sys.stdout = RoutedOutput(originalStdout)
+    builtins.input = console_input
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=maxConcurrent) as executor:
+            # Each job gets its own copy of the context, so setting its output doesn't affect the others
+            for future in [executor.submit(contextvars.copy_context().run, run_job, job) for job in jobs]:
+                future.result()
+    finally:
+        sys.stdout = originalStdout
+        builtins.input = _originalInput
@@ -31,14 +31,18 @@ class CloudConfig:
     batch_tts_synthesize: bool
     google_project_id: str
     google_translate_mode: GoogleTranslateMode
+    google_tts_max_concurrent: int
+    google_tts_requests_per_minute: float
     deepl_api_key: str
     azure_speech_key: str
     azure_speech_region: str
     azure_translate_key: str
     azure_translate_region: str
+    azure_tts_max_concurrent: int
     elevenlabs_api_key: str
     elevenlabs_default_model: ElevenLabsModel
     elevenlabs_max_concurrent: int
+    elevenlabs_adaptive_concurrency: bool
 
     @classmethod
     def from_dict(cls, config_dict: dict[str, str]) -> 'CloudConfig':
@@ -49,14 +53,18 @@ class CloudConfig:
             batch_tts_synthesize=parse_bool_strict(config_dict['batch_tts_synthesize']),
             google_project_id=config_dict['google_project_id'],
             google_translate_mode=GoogleTranslateMode(config_dict['google_translate_mode'].lower()),
+            google_tts_max_concurrent=int(config_dict.get('google_tts_max_concurrent', '8')),
+            google_tts_requests_per_minute=float(config_dict.get('google_tts_requests_per_minute', '100')),
             deepl_api_key=config_dict['deepl_api_key'],
             azure_speech_key=config_dict['azure_speech_key'],
             azure_speech_region=config_dict['azure_speech_region'],
             azure_translate_key=config_dict['azure_translate_key'],
             azure_translate_region=config_dict['azure_translate_region'],
+            azure_tts_max_concurrent=int(config_dict.get('azure_tts_max_concurrent', '8')),
             elevenlabs_api_key=config_dict['elevenlabs_api_key'],
             elevenlabs_default_model=ElevenLabsModel(config_dict['elevenlabs_default_model']),
-            elevenlabs_max_concurrent=int(config_dict['elevenlabs_max_concurrent'])
+            elevenlabs_max_concurrent=int(config_dict['elevenlabs_max_concurrent']),
+            elevenlabs_adaptive_concurrency=parse_bool_strict(config_dict.get('elevenlabs_adaptive_concurrency', 'True'))
         )
 
 @dataclass
@@ -68,10 +76,27 @@ class Config:
     original_language: str
     formality_preference: FormalityPreference
     output_format: AudioFormat
+    render_mode: AudioRenderMode
+    streaming_window_seconds: int
+    filtergraph_max_inputs: int
+    incremental_render: bool
+    concurrent_languages: int
+    pipelined_processing: bool
     synth_audio_encoding: str
+    tts_audio_format: TTSAudioFormat
     synth_sample_rate: int
+    canvas_sample_rate: int
     two_pass_voice_synth: bool
+    two_pass_tolerance: float
+    learn_speaking_rate: bool
     local_audio_stretch_method: AudioStretchMethod
+    clip_processing_workers: Union[str, int] # 'auto' or int
+    silence_trim_threshold_db: float
+    silence_trim_padding_ms: int
+    clip_cache: bool
+    clip_cache_max_size_mb: int
+    tts_cache: bool
+    tts_cache_max_size_mb: int
     force_stretch_with_twopass: bool
     force_always_stretch: bool
     azure_sentence_pause: Union[str, int] # 'default' or int
@@ -101,10 +126,27 @@ class Config:
             original_language=config_dict['original_language'],
             formality_preference=FormalityPreference(config_dict['formality_preference']),
             output_format=AudioFormat(config_dict['output_format']),
+            render_mode=AudioRenderMode(config_dict.get('render_mode', 'canvas').lower()),
+            streaming_window_seconds=int(config_dict.get('streaming_window_seconds', '30')),
+            filtergraph_max_inputs=int(config_dict.get('filtergraph_max_inputs', '200')),
+            incremental_render=parse_bool_strict(config_dict.get('incremental_render', 'False')),
+            concurrent_languages=max(1, int(config_dict.get('concurrent_languages', '1'))),
+            pipelined_processing=parse_bool_strict(config_dict.get('pipelined_processing', 'False')),
             synth_audio_encoding=config_dict['synth_audio_encoding'],
+            tts_audio_format=TTSAudioFormat(config_dict.get('tts_audio_format', 'mp3').lower()),
             synth_sample_rate=int(config_dict['synth_sample_rate']),
+            canvas_sample_rate=int(config_dict.get('canvas_sample_rate', '48000')),
             two_pass_voice_synth=parse_bool_strict(config_dict['two_pass_voice_synth']),
+            two_pass_tolerance=max(0.0, float(config_dict.get('two_pass_tolerance', '0.05'))),
+            learn_speaking_rate=parse_bool_strict(config_dict.get('learn_speaking_rate', 'True')),
             local_audio_stretch_method=AudioStretchMethod(config_dict['local_audio_stretch_method']),
+            clip_processing_workers=parse_int_str_union(config_dict.get('clip_processing_workers', 'auto'), ["auto"]),
+            silence_trim_threshold_db=float(config_dict.get('silence_trim_threshold_db', '-50')),
+            silence_trim_padding_ms=int(config_dict.get('silence_trim_padding_ms', '0')),
+            clip_cache=parse_bool_strict(config_dict.get('clip_cache', 'True')),
+            clip_cache_max_size_mb=int(config_dict.get('clip_cache_max_size_mb', '2000')),
+            tts_cache=parse_bool_strict(config_dict.get('tts_cache', 'True')),
+            tts_cache_max_size_mb=int(config_dict.get('tts_cache_max_size_mb', '2000')),
             force_stretch_with_twopass=parse_bool_strict(config_dict['force_stretch_with_twopass']),
             force_always_stretch=parse_bool_strict(config_dict['force_always_stretch']),
             azure_sentence_pause=parse_int_str_union(config_dict['azure_sentence_pause'], ["default"]),
@@ -0,0 +1,150 @@
+import os
+import re
+import json
+from dataclasses import dataclass
+from typing import cast
+
+from Scripts.shared_imports import *
+import Scripts.utils as utils
+from Scripts.disk_cache import DiskCache
+
+# Pronunciation overrides from the SSML_Customization files, compiled into a single regex so each line is only scanned once
+# Every entry becomes one alternative in the regex, in the same order the files were applied before: interpret-as, urls, aliases, phonemes
+# Where several entries could match at the same spot, the one that comes first wins. Text that already matched isn't scanned again,
+# so an override is never applied inside the tag of another one
+
+INTERPRET_AS_FILE = os.path.join('SSML_Customization', 'interpret-as.csv')
+ALIAS_FILE = os.path.join('SSML_Customization', 'aliases.csv')
+URL_LIST_FILE = os.path.join('SSML_Customization', 'url_list.txt')
+PHONEME_FILE = os.path.join('SSML_Customization', 'Phoneme_Pronunciation.csv')
+PRONUNCIATION_CACHE_FOLDER = os.path.join(CACHE_DIRECTORY, 'Pronunciation')
+COMPILED_FORMAT_VERSION = 1
+PRONUNCIATION_CACHE_MAX_SIZE_MB = 5 # Old compiled versions are only kept until this fills up
+
+# Matches the top level domain extension and the punctuation before/after it, and any periods, slashes or colons, to be spoken as characters
+URL_PUNCTUATION_REGEX = re.compile(r'((?:\.[a-z]{2,6}(?:\/|$|\s))|(?:[\.\/:]+))')
+# A numbered backreference like \1, meaning an odd number of backslashes before the digit
+NUMBERED_BACKREFERENCE_REGEX = re.compile(r'(?<!\\)(?:\\\\)*\\[1-9]')
+
+# What a match of one entry is replaced with. If keepMatch is True, the matched text is wrapped in the prefix and suffix, otherwise it's replaced by the prefix
+@dataclass
+class OverrideReplacement:
+    prefix: str
+    suffix: str = ''
+    keepMatch: bool = True
+
+def _is_case_sensitive(value:str) -> bool:
+    if value is None or value.strip() == "":
+        return False
+    return parseBool(value)
+
+# Wraps an entry's pattern so it only applies the case sensitivity of that entry
+def _with_case(pattern:str, caseSensitive:bool) -> str:
+    return pattern if caseSensitive else f'(?i:{pattern})'
+
+# Reads the customization files and returns the pattern of every entry in order, along with what to replace its matches with
+def build_override_entries() -> list[tuple[str, OverrideReplacement]]:
+    entries:list[tuple[str, OverrideReplacement]] = []
+
+    for entryDict in utils.csv_to_dictList(INTERPRET_AS_FILE):
+        entryText = entryDict['Text']
+        if not entryText:
+            continue
+        entryInterpretAsType = entryDict['interpret-as Type']
+        entryFormat = entryDict['Format (Optional)']
+        if entryFormat == "":
+            sayAsTagStart = f'<say-as interpret-as="{entryInterpretAsType}">'
+        else:
+            sayAsTagStart = f'<say-as interpret-as="{entryInterpretAsType}" format="{entryFormat}">'
+        # Find the word, with optional punctuation after, and optional quotes before or after
+        findWordRegex = rf'\b["\']?{entryText}[.,!?]?["\']?\b'
+        entries.append((_with_case(findWordRegex, _is_case_sensitive(entryDict['Case Sensitive (True/False)'])), OverrideReplacement(sayAsTagStart, '</say-as>')))
+
+    for url in utils.txt_to_list(URL_LIST_FILE):
+        taggedURL = URL_PUNCTUATION_REGEX.sub(r'<say-as interpret-as="characters">\1</say-as>', url)
+        entries.append((re.escape(url), OverrideReplacement(taggedURL, keepMatch=False)))
+
+    for entryDict in utils.csv_to_dictList(ALIAS_FILE):
+        entryText = entryDict['Original Text']
+        if not entryText:
+            continue
+        findWordRegex = rf'\b["\'()]?{entryText}[.,!?()]?["\']?\b'
+        entries.append((_with_case(findWordRegex, _is_case_sensitive(entryDict['Case Sensitive (True/False)'])), OverrideReplacement(entryDict['Alias'], keepMatch=False)))
+
+    for entryDict in utils.csv_to_dictList(PHONEME_FILE):
+        entryText = entryDict['Text']
+        if not entryText:
+            continue
+        phonemeTagStart = f'<phoneme alphabet="{entryDict["Phonetic Alphabet"]}" ph="{entryDict["Phonetic Pronunciation"]}">'
+        findWordRegex = rf'\b["\'()]?{entryText}[.,!?()]?["\']?\b'
+        entries.append((_with_case(findWordRegex, _is_case_sensitive(entryDict['Case Sensitive (True/False)'])), OverrideReplacement(phonemeTagStart, '</phoneme>')))
+
+    return entries
+
+# Returns the entries whose patterns can go in the combined regex, printing a warning for each one that's skipped
+# Each entry is compiled on its own first, so one bad entry doesn't stop the rest from working
+def valid_override_entries(entries:list[tuple[str, OverrideReplacement]]) -> list[tuple[str, OverrideReplacement]]:
+    validEntries:list[tuple[str, OverrideReplacement]] = []
+    groupNames:set[str] = set()
+    for pattern, replacement in entries:
+        try:
+            compiledPattern = re.compile(pattern)
+        except re.error as e:
+            print(f"WARNING: Skipping pronunciation override with an invalid pattern: {pattern}  ({e})")
+            continue
+        # In the combined regex, every entry is inside another group, so group numbers in the pattern would point at the wrong group
+        if NUMBERED_BACKREFERENCE_REGEX.search(pattern):
+            print(f"WARNING: Skipping pronunciation override with a numbered backreference, which isn't supported. Use a named group instead: {pattern}")
+            continue
+        # Group names must be unique across the combined regex, and the o<number> names are used for the entries themselves
+        duplicateNames = [name for name in compiledPattern.groupindex if name in groupNames or re.fullmatch(r'o\d+', name)]
+        if duplicateNames:
+            print(f"WARNING: Skipping pronunciation override with a group name that is already used ({', '.join(duplicateNames)}): {pattern}")
+            continue
+        groupNames.update(compiledPattern.groupindex)
+        validEntries.append((pattern, replacement))
+    return validEntries
+
+class PronunciationOverrides:
+    def __init__(self, entries:list[tuple[str, OverrideReplacement]]):
+        entries = valid_override_entries(entries)
+        self.entries = entries
+        self.replacements = [replacement for _, replacement in entries]
+        # Each entry gets its own named group, so the entry that matched can be found from the group name without checking every group
+        self.regex = re.compile('|'.join(f'(?P<o{index}>{pattern})' for index, (pattern, _) in enumerate(entries))) if entries else None
+
+    # Applies every override to the text in a single scan
+    def apply(self, text:str) -> str:
+        if self.regex is None:
+            return text
+        return self.regex.sub(self._replace_match, text)
+
+    def _replace_match(self, match:re.Match) -> str:
+        replacement = self.replacements[int(cast(str, match.lastgroup)[1:])]
+        if replacement.keepMatch:
+            return f'{replacement.prefix}{match.group(0)}{replacement.suffix}'
+        return replacement.prefix
+
+    # Loads the compiled entries from the cache if none of the customization files changed since they were compiled, otherwise reads the files again
+    @classmethod
+    def load(cls) -> 'PronunciationOverrides':
+        cache = DiskCache(PRONUNCIATION_CACHE_FOLDER, PRONUNCIATION_CACHE_MAX_SIZE_MB)
+        cacheKey = overrides_signature()
+        cachedData = cache.get(cacheKey)
+        if cachedData is not None:
+            try:
+                return cls([(pattern, OverrideReplacement(*replacement)) for pattern, replacement in json.loads(cachedData)])
+            except (ValueError, TypeError, re.error):
+                pass
+        entries = build_override_entries()
+        cache.put(cacheKey, json.dumps([(pattern, [replacement.prefix, replacement.suffix, replacement.keepMatch]) for pattern, replacement in entries]).encode('utf-8'))
+        cache.enforce_size_limit()
+        return cls(entries)
+
+# Changes whenever any of the customization files is edited. Only checks the files' modification times and sizes, without reading them
+def overrides_signature() -> str:
+    return DiskCache.make_key('pronunciation', COMPILED_FORMAT_VERSION, [_file_signature(filePath) for filePath in (INTERPRET_AS_FILE, URL_LIST_FILE, ALIAS_FILE, PHONEME_FILE)])
+
+def _file_signature(filePath:str) -> tuple[str, int, int]:
+    fileStat = os.stat(filePath)
+    return (filePath, fileStat.st_mtime_ns, fileStat.st_size)
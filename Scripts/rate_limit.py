@@ -0,0 +1,38 @@
+import time
+import threading
+
+# Token bucket for keeping requests under a per-minute quota. One bucket can be shared by any number of threads
+# Tokens are added continuously at the allowed rate, up to the capacity of the bucket. Each request takes one token, waiting for it if needed
+# The bucket starts empty and has a small capacity, so the requests are spread out evenly instead of bursting at the start of each minute
+class TokenBucket:
+    def __init__(self, requestsPerMinute:float, capacity:float=1):
+        if requestsPerMinute <= 0:
+            raise ValueError(f"ERROR: Requests per minute must be above zero. It was: {requestsPerMinute}")
+        self.ratePerSecond = requestsPerMinute / 60
+        self.capacity = capacity
+        self.tokens = 0.0
+        self.lastRefill = time.monotonic() # Can be in the future while paused
+        self.lock = threading.Lock()
+
+    def _refill(self, now:float) -> None:
+        if now > self.lastRefill:
+            self.tokens = min(self.capacity, self.tokens + (now - self.lastRefill) * self.ratePerSecond)
+            self.lastRefill = now
+
+    # Blocks until a request is allowed
+    def acquire(self) -> None:
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                waitTime = max(0.0, self.lastRefill - now) + (1 - self.tokens) / self.ratePerSecond
+            time.sleep(waitTime)
+
+    # Empties the bucket and stops it refilling for a while, so every thread backs off when the service says the quota was exceeded anyway
+    def pause(self, seconds:float) -> None:
+        with self.lock:
+            self.tokens = 0.0
+            self.lastRefill = max(self.lastRefill, time.monotonic() + seconds)
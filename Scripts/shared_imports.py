@@ -42,6 +42,11 @@ OUTPUT_YTSYNCED_FOLDER = os.path.join(OUTPUT_FOLDER, OUTPUT_YTSYNCED_DIRECTORY)
 OUTPUT_CUSTOM_SENTENCE_TIMING_DIRECTORY = 'Custom_Sentence_Timing'
 OUTPUT_CUSTOM_SENTENCE_TIMING_FOLDER = os.path.join(OUTPUT_FOLDER, OUTPUT_CUSTOM_SENTENCE_TIMING_DIRECTORY)
 
+# Caches kept between runs. Not inside workingFolder, because that gets cleared out
+CACHE_DIRECTORY = 'Cache'
+CLIP_CACHE_FOLDER = os.path.join(CACHE_DIRECTORY, 'Clips')
+TTS_CACHE_FOLDER = os.path.join(CACHE_DIRECTORY, 'TTS')
+
 
 # Fix original video path if debug mode
 if config.debug_mode and (ORIGINAL_VIDEO_PATH == '' or ORIGINAL_VIDEO_PATH.lower() == 'none'):
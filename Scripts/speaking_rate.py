@@ -0,0 +1,104 @@
+import os
+import json
+import threading
+from typing import Any, Optional, cast
+
+from Scripts.shared_imports import *
+from Scripts.disk_cache import DiskCache
+import Scripts.utils as utils
+
+# Speaking rate profiles: How many characters per second each voice speaks at normal speed, learned from the clips of past runs
+# With a profile, the first request for each line can already ask for about the right speaking rate, so the clip comes out close to the right length
+# Each voice keeps running totals of characters and seconds. Once they get large, both are scaled down, so recent runs count more than old ones
+# A hash of every clip learned from is kept too. Running the same video again mostly reuses the same clips from the TTS cache,
+# and counting those again would pull the profile towards that one video without adding anything new
+
+PROFILES_FILE = os.path.join(CACHE_DIRECTORY, 'speaking_rate_profiles.json')
+MIN_PROFILE_CHARACTERS = 1000 # A voice's profile isn't used until it has learned from at least this many characters
+MAX_PROFILE_CHARACTERS = 200000
+MIN_SPEAKING_RATE = 0.25 # The range Google TTS allows
+MAX_SPEAKING_RATE = 4.0
+MAX_LEARNED_CLIPS = 20000 # Per voice. The oldest are forgotten first
+
+_profilesLock = threading.Lock() # Several languages can be learning at the same time
+
+def profile_key(langDict:dict[LangDictKeys, Any]) -> str:
+    return '|'.join(str(part) for part in (cloudConfig.tts_service, langDict[LangDictKeys.languageCode], langDict[LangDictKeys.voiceName], langDict[LangDictKeys.voiceModel]))
+
+def load_profiles() -> dict[str, dict[str, Any]]:
+    try:
+        with open(PROFILES_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_profiles(profiles:dict[str, dict[str, Any]]) -> None:
+    utils.write_json_atomic(PROFILES_FILE, profiles)
+
+# Returns the characters per second the voice speaks at a speaking rate of 1.0, or None if there isn't enough data for it yet
+def get_characters_per_second(langDict:dict[LangDictKeys, Any]) -> Optional[float]:
+    with _profilesLock:
+        profile = load_profiles().get(profile_key(langDict))
+    if profile is None or profile['characters'] < MIN_PROFILE_CHARACTERS or profile['seconds'] <= 0:
+        return None
+    return profile['characters'] / profile['seconds']
+
+def count_characters(text:str) -> int:
+    return len(text.strip())
+
+# Sets the speaking rate to request for each line on the first pass, from the voice's profile. Lines are left alone if there's no profile yet
+def set_first_pass_speaking_rates(subsDict:SubtitleDict, langDict:dict[LangDictKeys, Any]) -> None:
+    charactersPerSecond = get_characters_per_second(langDict)
+    if charactersPerSecond is None:
+        return
+    for value in subsDict.values():
+        predictedMs = count_characters(str(value[SubsDictKeys.translated_text])) / charactersPerSecond * 1000
+        speakingRate = predictedMs / float(value[SubsDictKeys.duration_ms])
+        value[SubsDictKeys.first_pass_speaking_rate] = round(min(MAX_SPEAKING_RATE, max(MIN_SPEAKING_RATE, speakingRate)), 2)
+
+# Identifies a clip by its audio, so the same clip is recognized no matter which line or run it came from
+def clip_hash(filePath:str) -> Optional[str]:
+    try:
+        return DiskCache.hash_file(filePath)[:16]
+    except OSError:
+        return None
+
+# Adds the first pass clips of these lines to the voice's profile, skipping any clip it already learned from. Their speed_factor must be the one measured from the first pass clip
+# A clip synthesized at speaking rate r would have been r times as long at the normal rate
+def learn_from_first_pass(subsDict:SubtitleDict, langDict:dict[LangDictKeys, Any]) -> None:
+    clips:list[tuple[str, SubtitleEntry]] = []
+    for value in subsDict.values():
+        if SubsDictKeys.speed_factor not in value:
+            continue
+        clipHash = clip_hash(str(value.get(SubsDictKeys.TTS_FilePath, '')))
+        if clipHash is not None:
+            clips.append((clipHash, value))
+    if not clips:
+        return
+
+    with _profilesLock:
+        profiles = load_profiles()
+        profile = profiles.setdefault(profile_key(langDict), {'characters': 0, 'seconds': 0.0})
+        learnedClips:list[str] = profile.setdefault('learnedClips', [])
+        learnedSet = set(learnedClips)
+        characters = 0
+        seconds = 0.0
+        for clipHash, value in clips:
+            if clipHash in learnedSet:
+                continue
+            learnedSet.add(clipHash)
+            learnedClips.append(clipHash)
+            trimmedDurationMs = cast(float, value[SubsDictKeys.speed_factor]) * float(value[SubsDictKeys.duration_ms])
+            characters += count_characters(str(value[SubsDictKeys.translated_text]))
+            seconds += trimmedDurationMs * cast(float, value.get(SubsDictKeys.first_pass_speaking_rate, 1.0)) / 1000
+        if characters == 0 or seconds <= 0:
+            return
+        del learnedClips[:-MAX_LEARNED_CLIPS]
+        profile['characters'] += characters
+        profile['seconds'] += seconds
+        if profile['characters'] > MAX_PROFILE_CHARACTERS:
+            scale = MAX_PROFILE_CHARACTERS / profile['characters']
+            profile['characters'] *= scale
+            profile['seconds'] *= scale
+        save_profiles(profiles)
+    print(f"Speaking rate profile for {langDict[LangDictKeys.voiceName]}: {profile['characters'] / profile['seconds']:.1f} characters per second")
@@ -16,6 +16,15 @@ import os
 import pathlib
 import langcodes
 import html
+import threading
+
+# Languages can be translated at the same time from different threads, and each thread needs its own http connection for the Google API
+_threadState = threading.local()
+
+def get_google_http() -> object:
+    if not hasattr(_threadState, 'http'):
+        _threadState.http = auth.new_google_http()
+    return _threadState.http
 
 # -------------------------------- No Translate and Manual Translation Functions -----------------------------------
 
@@ -274,7 +283,7 @@ def translate_with_google_and_process(textList:list[str], targetLanguage:str) ->
                 'model': model_path,
                 #'glossaryConfig': {}
             }
-        ).execute()
+        ).execute(http=get_google_http())
             
     else:
         response = auth.GOOGLE_TRANSLATE_API.projects().translateText( #type:ignore
@@ -287,7 +296,7 @@ def translate_with_google_and_process(textList:list[str], targetLanguage:str) ->
                 #'model': 'nmt',
                 #'glossaryConfig': {}
             }
-        ).execute()
+        ).execute(http=get_google_http())
         
     translatedTextString:str = response['translations'][0]['translatedText']
     
@@ -40,6 +40,7 @@ Translation fields (added after translation):
 TTS fields (added after synthesis):
     - TTS_FilePath: str - Path to synthesized audio file
     - speed_factor: float - Speed adjustment factor for audio
+    - first_pass_speaking_rate: float - Speaking rate requested on the first pass, predicted from the voice's speaking rate profile (Google only)
     
 Audio processing fields (added during audio building):
     - TTS_FilePath_Trimmed: str - Path to trimmed audio file
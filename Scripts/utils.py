@@ -1,5 +1,7 @@
 import csv
 import os
+import json
+import tempfile
 # Interprets a string as a boolean. Returns True or False
 def parseBool(string:str|bool, silent:bool=False):
     if type(string) == str:
@@ -103,4 +105,17 @@ def time_to_ms(time_str:str) -> int:
         seconds, milliseconds = rest.split(',')
         return (int(hours) * 3600000) + (int(minutes) * 60000) + (int(seconds) * 1000) + int(milliseconds)
     except ValueError:
-        return 0
\ No newline at end of file
+        return 0
+
+# Saves the data as a JSON file. It's written to a temporary file first and then swapped in, so the file is never left half written
+def write_json_atomic(filePath:str, data:object) -> None:
+    folder = os.path.dirname(filePath) or '.'
+    os.makedirs(folder, exist_ok=True)
+    fileDescriptor, tempPath = tempfile.mkstemp(dir=folder, suffix='.tmp')
+    try:
+        with os.fdopen(fileDescriptor, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2)
+        os.replace(tempPath, filePath)
+    except BaseException:
+        os.remove(tempPath)
+        raise
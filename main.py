@@ -6,28 +6,38 @@
 # License: GPLv3
 # NOTE: By contributing to this project, you agree to the terms of the GPLv3 license, and agree to grant the project owner the right to also provide or sell this software, including your contribution, to anyone under any other license, with no compensation to you.
 
-version = '0.21.0'
-print(f"------- 'Auto Synced Translated Dubs' script by ThioJoe - Release version {version} -------")
+from __future__ import annotations
 
-# Import other files
-from Scripts.shared_imports import *
-import Scripts.TTS as TTS
-import Scripts.audio_builder as audio_builder
-import Scripts.utils as utils
-#import Scripts.auth as auth
-import Scripts.translate as translate
+version = '0.21.0'
 
 # Import built in modules
 import re
 import copy
 import asyncio
+import functools
 from typing import Any
-# Import winsound if on Windows
-if os.name == 'nt':
-    import winsound
 
-# Import other modules
-import ffprobe # pyright: ignore[reportUnusedImport] # ffprobe is used as subprocess, not sure if this module is needed
+# Only import everything else when started directly. Clip processing worker processes import this file again (as __mp_main__),
+# and must not load the settings or authenticate with the cloud services, which importing TTS and translate does. They only need Scripts.clip_processing
+if __name__ == '__main__':
+    print(f"------- 'Auto Synced Translated Dubs' script by ThioJoe - Release version {version} -------")
+
+    # Import other files
+    from Scripts.shared_imports import *
+    import Scripts.TTS as TTS
+    import Scripts.audio_builder as audio_builder
+    from Scripts.incremental_render import IncrementalRenderStore
+    from Scripts.language_scheduler import LanguageJob, run_languages
+    import Scripts.utils as utils
+    #import Scripts.auth as auth
+    import Scripts.translate as translate
+
+    # Import winsound if on Windows
+    if os.name == 'nt':
+        import winsound
+
+    # Import other modules
+    import ffprobe # pyright: ignore[reportUnusedImport] # ffprobe is used as subprocess, not sure if this module is needed
 
 # EXTERNAL REQUIREMENTS:
 # rubberband binaries: https://breakfastquay.com/rubberband/ - Put rubberband.exe and sndfile.dll in the same folder as this script
@@ -37,60 +47,59 @@ import ffprobe # pyright: ignore[reportUnusedImport] # ffprobe is used as subpro
 
 #---------------------------------------- Batch File Processing ----------------------------------------
 
-# Get list of languages to process
-languageNums:list[str] = batchConfig['SETTINGS']['enabled_languages'].replace(' ','').split(',')
-srtFile = os.path.abspath(batchConfig['SETTINGS']['srt_file_path'].strip("\""))
-
-# Get original video file path, also allow you to debug using a subtitle file without having the original video file
-videoFilePath = batchConfig['SETTINGS']['original_video_file_path']
-
-# Validate the number of sections
-for num in languageNums:
-    # Check if section exists
-    if not batchConfig.has_section(f'LANGUAGE-{num}'):
-        raise ValueError(f'Invalid language number in batch.ini: {num} - Make sure the section [LANGUAGE-{num}] exists')
-
-# Validate the settings in each batch section
-for num in languageNums:
-    if not batchConfig.has_option(f'LANGUAGE-{num}', 'synth_language_code'):
-        raise ValueError(f'Invalid configuration in batch.ini: {num} - Make sure the option "synth_language_code" exists under [LANGUAGE-{num}]')
-    if not batchConfig.has_option(f'LANGUAGE-{num}', 'synth_voice_name'):
-        raise ValueError(f'Invalid configuration in batch.ini: {num} - Make sure the option "synth_voice_name" exists under [LANGUAGE-{num}]')
-    if not batchConfig.has_option(f'LANGUAGE-{num}', 'translation_target_language'):
-        raise ValueError(f'Invalid configuration in batch.ini: {num} - Make sure the option "translation_target_language" exists under [LANGUAGE-{num}]')
-    if not batchConfig.has_option(f'LANGUAGE-{num}', 'synth_voice_gender'):
-        raise ValueError(f'Invalid configuration in batch.ini: {num} - Make sure the option "synth_voice_gender" exists under [LANGUAGE-{num}]')    
-
-# Create a dictionary of the settings from each section
-batchSettings:dict[str, Any] = {}
-for num in languageNums:
-
-    # Set voice model if applicable (different from voice name, only used by some services)
-    if not batchConfig.has_option(f'LANGUAGE-{num}', 'model'):
-        model = "default"
-    else:
-        model = batchConfig[f'LANGUAGE-{num}']['model']
-        
-    if not batchConfig.has_option(f'LANGUAGE-{num}', 'synth_voice_style') or batchConfig[f'LANGUAGE-{num}']['synth_voice_style'] == "":
-        style = "default"
-    else:
-        style = batchConfig[f'LANGUAGE-{num}']['synth_voice_style']
-        
-    if cloudConfig.tts_service == 'elevenlabs':
-        if model == "default":
-            model = cloudConfig.elevenlabs_default_model
-    else:
-        model = "default"
-
-    # Set the dictionary values for each language
-    batchSettings[num] = {
-        'synth_language_code': batchConfig[f'LANGUAGE-{num}']['synth_language_code'],
-        'synth_voice_name': batchConfig[f'LANGUAGE-{num}']['synth_voice_name'],
-        'translation_target_language': batchConfig[f'LANGUAGE-{num}'][LangDataKeys.translation_target_language],
-        'synth_voice_gender': batchConfig[f'LANGUAGE-{num}']['synth_voice_gender'],
-        'synth_voice_model': model,
-        'synth_voice_style': style,
-    }
+# Reads and validates the settings of each enabled language from batch.ini
+def load_batch_settings() -> dict[str, Any]:
+    # Get list of languages to process
+    languageNums:list[str] = batchConfig['SETTINGS']['enabled_languages'].replace(' ','').split(',')
+
+    # Validate the number of sections
+    for num in languageNums:
+        # Check if section exists
+        if not batchConfig.has_section(f'LANGUAGE-{num}'):
+            raise ValueError(f'Invalid language number in batch.ini: {num} - Make sure the section [LANGUAGE-{num}] exists')
+
+    # Validate the settings in each batch section
+    for num in languageNums:
+        if not batchConfig.has_option(f'LANGUAGE-{num}', 'synth_language_code'):
+            raise ValueError(f'Invalid configuration in batch.ini: {num} - Make sure the option "synth_language_code" exists under [LANGUAGE-{num}]')
+        if not batchConfig.has_option(f'LANGUAGE-{num}', 'synth_voice_name'):
+            raise ValueError(f'Invalid configuration in batch.ini: {num} - Make sure the option "synth_voice_name" exists under [LANGUAGE-{num}]')
+        if not batchConfig.has_option(f'LANGUAGE-{num}', 'translation_target_language'):
+            raise ValueError(f'Invalid configuration in batch.ini: {num} - Make sure the option "translation_target_language" exists under [LANGUAGE-{num}]')
+        if not batchConfig.has_option(f'LANGUAGE-{num}', 'synth_voice_gender'):
+            raise ValueError(f'Invalid configuration in batch.ini: {num} - Make sure the option "synth_voice_gender" exists under [LANGUAGE-{num}]')    
+
+    # Create a dictionary of the settings from each section
+    batchSettings:dict[str, Any] = {}
+    for num in languageNums:
+
+        # Set voice model if applicable (different from voice name, only used by some services)
+        if not batchConfig.has_option(f'LANGUAGE-{num}', 'model'):
+            model = "default"
+        else:
+            model = batchConfig[f'LANGUAGE-{num}']['model']
+
+        if not batchConfig.has_option(f'LANGUAGE-{num}', 'synth_voice_style') or batchConfig[f'LANGUAGE-{num}']['synth_voice_style'] == "":
+            style = "default"
+        else:
+            style = batchConfig[f'LANGUAGE-{num}']['synth_voice_style']
+
+        if cloudConfig.tts_service == 'elevenlabs':
+            if model == "default":
+                model = cloudConfig.elevenlabs_default_model
+        else:
+            model = "default"
+
+        # Set the dictionary values for each language
+        batchSettings[num] = {
+            'synth_language_code': batchConfig[f'LANGUAGE-{num}']['synth_language_code'],
+            'synth_voice_name': batchConfig[f'LANGUAGE-{num}']['synth_voice_name'],
+            'translation_target_language': batchConfig[f'LANGUAGE-{num}'][LangDataKeys.translation_target_language],
+            'synth_voice_gender': batchConfig[f'LANGUAGE-{num}']['synth_voice_gender'],
+            'synth_voice_model': model,
+            'synth_voice_style': style,
+        }
+    return batchSettings
 
 
 #======================================== Parse SRT File ================================================
@@ -169,12 +178,6 @@ def parse_srt_file(srtFileLines: list[str], preTranslated: bool = False) -> Subt
 
 # ----------------------------------------
 
-# Open an srt file and read the lines into a list
-with open(srtFile, 'r', encoding='utf-8-sig') as f:
-    originalSubLines = f.readlines()
-
-originalLanguageSubsDict: SubtitleDictStr = parse_srt_file(originalSubLines)
-
 #======================================== Get Total Duration ================================================
 # Final audio file Should equal the length of the video in milliseconds
 def get_duration(filename:str) -> int:
@@ -189,25 +192,6 @@ def get_duration(filename:str) -> int:
     durationMS = round(float(duration)*1000) # Convert to milliseconds
     return durationMS
 
-# Get the duration of the original video file
-if config.debug_mode and ORIGINAL_VIDEO_PATH.lower() == "debug.test":
-    # Copy the duration based on the last timestamp of the subtitles
-    totalAudioLength:int = int(originalLanguageSubsDict[str(len(originalLanguageSubsDict))][SubsDictKeys.end_ms])
-else:
-    totalAudioLength:int = get_duration(ORIGINAL_VIDEO_PATH)
-
-
-#============================================= Directory Validation =====================================================
-
-# Check if the output folder exists, if not, create it
-if not os.path.exists(OUTPUT_DIRECTORY):
-    os.makedirs(OUTPUT_DIRECTORY)
-if not os.path.exists(OUTPUT_FOLDER):
-    os.makedirs(OUTPUT_FOLDER)
-
-# Check if the working folder exists, if not, create it
-if not os.path.exists('workingFolder'):
-    os.makedirs('workingFolder')
 
 #======================================== Translation and Text-To-Speech ================================================
 
@@ -358,7 +342,7 @@ def get_pretranslated_subs_dict(langData: dict[str, str]) -> SubtitleDict:
     return {}
 
 # Process a language: Translate, Synthesize, and Build Audio
-def process_language(langData:dict[str, str], processedCount:int, totalLanguages:int):
+def process_language(langData:dict[str, str], processedCount:int, totalLanguages:int, originalLanguageSubsDict:SubtitleDictStr, totalAudioLength:int, workingFolder:str='workingFolder'):
     langDict: dict[LangDictKeys, Any] = {
         LangDictKeys.targetLanguage: langData[LangDataKeys.translation_target_language], 
         LangDictKeys.voiceName: langData[LangDataKeys.synth_voice_name], 
@@ -367,8 +351,10 @@ def process_language(langData:dict[str, str], processedCount:int, totalLanguages
         LangDictKeys.translateService: langData[LangDataKeys.translate_service],
         LangDictKeys.formality: langData[LangDataKeys.formality],
         LangDictKeys.voiceModel: langData[LangDataKeys.synth_voice_model],
-        LangDictKeys.voiceStyle: langData[LangDataKeys.synth_voice_style]
+        LangDictKeys.voiceStyle: langData[LangDataKeys.synth_voice_style],
+        LangDictKeys.workingFolder: workingFolder
     }
+    os.makedirs(workingFolder, exist_ok=True)
 
     originalSubDictCopy: SubtitleDict = convert_dict_string_keys_to_int(copy.deepcopy(originalLanguageSubsDict))
     individualLanguageSubsDict: SubtitleDict = {}
@@ -409,36 +395,94 @@ def process_language(langData:dict[str, str], processedCount:int, totalLanguages
             print(f"Note: Ensure the subtitle filename for this language ends with: ' - {langData[LangDataKeys.translation_target_language]}.srt'\n")
             return
 
+    # With incremental rendering, only lines that changed since the last run are synthesized. The synthesize functions update the entries in place
+    incrementalStore = None
+    synthesizeDict = individualLanguageSubsDict
+    if config.incremental_render:
+        incrementalStore = IncrementalRenderStore(langDict, totalAudioLength, config.canvas_sample_rate)
+        changedKeys = incrementalStore.find_changed_keys(individualLanguageSubsDict)
+        synthesizeDict = {key: individualLanguageSubsDict[key] for key in changedKeys}
+        if not incrementalStore.fullRender:
+            print(f"Incremental render: {len(changedKeys)} of {len(individualLanguageSubsDict)} lines changed since the last run")
+
     # Synthesize audio to files, and store the location of the corresponding audio file in the dictionary
-    if cloudConfig.batch_tts_synthesize == True and cloudConfig.tts_service == TTSService.AZURE:
-        individualLanguageSubsDict = TTS.synthesize_dictionary_batch(individualLanguageSubsDict, langDict, skipSynthesize=config.skip_synthesize)
-    elif cloudConfig.tts_service == 'elevenlabs':
-        individualLanguageSubsDict = asyncio.run(TTS.synthesize_dictionary_async(individualLanguageSubsDict, langDict, skipSynthesize=config.skip_synthesize, max_concurrent_jobs=cloudConfig.elevenlabs_max_concurrent))
+    synthesizedKeys = None
+    if not synthesizeDict:
+        print("No lines need to be synthesized.")
+    elif config.pipelined_processing:
+        # Synthesis runs in the background, and each line's audio is processed by build_audio as soon as it's ready
+        synthesizedKeys = TTS.synthesize_all_streaming(synthesizeDict, langDict, skipSynthesize=config.skip_synthesize)
     else:
-        individualLanguageSubsDict = TTS.synthesize_dictionary(individualLanguageSubsDict, langDict, skipSynthesize=config.skip_synthesize)
+        synthesizeDict = TTS.synthesize_all(synthesizeDict, langDict, skipSynthesize=config.skip_synthesize)
 
     # Build audio
-    audio_builder.build_audio(individualLanguageSubsDict, langDict, totalAudioLength, config.two_pass_voice_synth)    
+    audio_builder.build_audio(individualLanguageSubsDict, langDict, totalAudioLength, config.two_pass_voice_synth, incrementalStore, synthesizedKeys)
 
 
 #======================================== Main Program ================================================
-# Set asyncio event loop policy to WindowsSelectorEventLoopPolicy if on Windows to avoid errors
-if sys.platform == 'win32':
-    asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
-
-# Counter for number of languages processed
-processedCount:int = 0
-totalLanguages:int = len(batchSettings)
-
-# Process all languages
-print(f"\n----- Beginning Processing of Languages -----")
-batchSettingsUpdated:dict[str, dict[str, str]] = translate.set_translation_info(batchSettings)
-for langNum, langData in batchSettingsUpdated.items():
-    processedCount += 1
-    # Process current fallback language
-    process_language(langData, processedCount, totalLanguages)
-
-# Play a system sound to indicate completion
-if os.name == 'nt':
-    sound_name = winsound.MB_ICONASTERISK  # represents the 'Asterisk' system sound
-    winsound.MessageBeep(sound_name)  # Play the system sound
+
+def main():
+    batchSettings = load_batch_settings()
+
+    # Open an srt file and read the lines into a list
+    srtFile = os.path.abspath(batchConfig['SETTINGS']['srt_file_path'].strip("\""))
+    with open(srtFile, 'r', encoding='utf-8-sig') as f:
+        originalSubLines = f.readlines()
+
+    originalLanguageSubsDict: SubtitleDictStr = parse_srt_file(originalSubLines)
+
+    # Get the duration of the original video file
+    if config.debug_mode and ORIGINAL_VIDEO_PATH.lower() == "debug.test":
+        # Copy the duration based on the last timestamp of the subtitles
+        totalAudioLength:int = int(originalLanguageSubsDict[str(len(originalLanguageSubsDict))][SubsDictKeys.end_ms])
+    else:
+        totalAudioLength:int = get_duration(ORIGINAL_VIDEO_PATH)
+
+    #============================================= Directory Validation =====================================================
+
+    # Check if the output folder exists, if not, create it
+    if not os.path.exists(OUTPUT_DIRECTORY):
+        os.makedirs(OUTPUT_DIRECTORY)
+    if not os.path.exists(OUTPUT_FOLDER):
+        os.makedirs(OUTPUT_FOLDER)
+
+    # Check if the working folder exists, if not, create it
+    if not os.path.exists('workingFolder'):
+        os.makedirs('workingFolder')
+
+    # Set asyncio event loop policy to WindowsSelectorEventLoopPolicy if on Windows to avoid errors
+    if sys.platform == 'win32':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+    # Counter for number of languages processed
+    processedCount:int = 0
+    totalLanguages:int = len(batchSettings)
+
+    # Process all languages
+    print(f"\n----- Beginning Processing of Languages -----")
+    batchSettingsUpdated:dict[str, dict[str, str]] = translate.set_translation_info(batchSettings)
+    # When processing several languages at once, each one gets its own working folder so their audio files don't overwrite each other
+    languageJobs:list[LanguageJob] = []
+    for langNum, langData in batchSettingsUpdated.items():
+        processedCount += 1
+        languageCode = langData[LangDataKeys.synth_language_code]
+        workingFolder = 'workingFolder' if config.concurrent_languages <= 1 else os.path.join('workingFolder', f"{langNum} - {languageCode}")
+        languageJobs.append(LanguageJob(
+            name=f"Language ({processedCount}/{totalLanguages}): {languageCode}",
+            logPath=os.path.join(OUTPUT_FOLDER, f"Log - {langNum} - {languageCode}.txt"),
+            run=functools.partial(process_language, langData, processedCount, totalLanguages, originalLanguageSubsDict, totalAudioLength, workingFolder),
+        ))
+    run_languages(languageJobs, config.concurrent_languages)
+
+    print(f"\n----- Finished Processing All Languages -----")
+    if TTS.deduplicatedRequestCount > 0:
+        print(f"Repeated lines that were only synthesized once: {TTS.deduplicatedRequestCount}")
+
+    # Play a system sound to indicate completion
+    if os.name == 'nt':
+        sound_name = winsound.MB_ICONASTERISK  # represents the 'Asterisk' system sound
+        winsound.MessageBeep(sound_name)  # Play the system sound
+
+# Only run when started directly. Clip processing worker processes import this file again, and must not re-run everything
+if __name__ == '__main__':
+    main()